@@ -0,0 +1,41 @@
+"""
+Asyncio transport for a Firmata board.
+
+Replaces the pyfirmata.util.Iterator thread and the per-sensor polling
+threads: the serial port is read from the event loop when it becomes
+readable, and the board's AnalogSampler hands the analog values to its
+consumers as they arrive. Roboface runs it with threaded=False; the UI
+and the control server drive their boards with boards.BoardManager.
+"""
+import asyncio
+
+from sampler import AnalogSampler
+
+
+class AsyncBoard:
+    def __init__(self, board, sampler=None):
+        self.board = board
+        self.sampler = sampler if sampler is not None else AnalogSampler(board)
+        self.loop = None
+
+    async def run(self):
+        """
+        Read from the board until cancelled.
+        """
+        self.loop = asyncio.get_running_loop()
+        if not self.sampler.reporting:
+            await self.sampler.arun()
+            return
+
+        # the port may be closed by the time the worker is cancelled
+        fd = self.board.sp.fileno()
+        readable = asyncio.Event()
+        self.loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                while self.board.bytes_available():
+                    self.board.iterate()
+        finally:
+            self.loop.remove_reader(fd)
@@ -0,0 +1,114 @@
+"""
+The arms of the cell: which boards they are on, their segments, and
+how their boards are opened.
+
+Nothing here imports pyfirmata or numpy until a board is opened, so the
+UI and the control server can import it for free.
+"""
+import json
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the boards and their ports, and the segment table: name, up and down
+# keys, board, pin, start angle and limits
+ARM_CONFIG = os.path.join(HERE, 'arm.json')
+# SIM runs a simulated arm in-process for every board, EMULATOR a
+# simulated arm behind the Firmata emulator, BOARD the arms on the ports
+SIM = 'sim'
+EMULATOR = 'emulator'
+BOARD = 'board'
+BACKEND = SIM
+PORT = '/dev/ttyACM0'
+# read on every board
+SENSOR_PINS = dict(current="a:0:i", voltage="a:1:i", base_res="a:2:i")
+# base potentiometer readings at 0 and 180 degrees, used until the base
+# has a calibration profile
+BASE_V_MIN = 0.064
+BASE_V_MAX = 0.58
+
+
+def load_arm(config=ARM_CONFIG):
+    """
+    The ports of the boards by name, and the segment table; segments
+    without a board are on the first one. The limits of a segment that
+    is one of the kinematic "joints" are those of the joint, so the UI
+    clamps where the kinematics solve; they are not given twice.
+    """
+    with open(config) as f:
+        arm = json.load(f)
+    boards = arm.get('boards', {'arm': {}})
+    ports = {name: board.get('port', PORT) for name, board in boards.items()}
+    first = next(iter(ports))
+    joints = arm.get('joints', {})
+    segments = arm['segments']
+    for s in segments:
+        s.setdefault('board', first)
+        joint = joints.get(s['name'])
+        if joint is not None:
+            if 'min' in s or 'max' in s:
+                raise ValueError(f"{config}: limits of {s['name']} belong in joints, not segments")
+            s['min'], s['max'] = joint['min'], joint['max']
+    return ports, segments
+
+
+def base_segment(segments, board):
+    """
+    The segment of the base of the board, the first of the board in the
+    table; its pot is read on SENSOR_PINS["base_res"].
+    """
+    return next(s for s in segments if s['board'] == board)
+
+
+def base_profile(name, directory=None):
+    """
+    The calibration profile of the base of the board, by the board's
+    name in arm.json as old/calibrate.py writes it, or a linear one
+    from BASE_V_MIN and BASE_V_MAX until it was calibrated.
+    """
+    from calprofile import CALIBRATION_DIR, CalibrationProfile, load_profile
+    return load_profile(
+        name, "base", default=CalibrationProfile.linear(BASE_V_MIN, BASE_V_MAX),
+        directory=directory or CALIBRATION_DIR,
+    )
+
+
+def simulated_board():
+    from simboard import SimBoard
+    # the current sensor reads 0.5 at no current and 0.4 per ampere, the
+    # voltage divider a tenth of the supply
+    sim = SimBoard()
+    sim.wire_current(0, [11, 10, 9, 6, 5, 3], zero=0.5, gain=0.4)
+    sim.wire_supply(1, 0.6, sag=0.005)
+    sim.wire_position(2, 11, BASE_V_MIN, BASE_V_MAX)
+    return sim
+
+
+def connect(backend=BACKEND, port=PORT):
+    """
+    The board for the backend, and the emulator when there is one.
+    Blocks for as long as pyfirmata waits for the board to reset.
+    """
+    if backend == SIM:
+        return simulated_board(), None
+    import pyfirmata
+    emulator = None
+    if backend == EMULATOR:
+        from emulator import FirmataEmulator
+        emulator = FirmataEmulator(simulated_board())
+        port = emulator.start()
+    return pyfirmata.Arduino(port), emulator
+
+
+def open_board(backend, port, emulators, name):
+    """
+    Open a board for its BoardWorker. The emulator of the board, if the
+    backend has one, is kept in emulators under the board's name, and
+    the one of an earlier opening stopped.
+    """
+    emulator = emulators.pop(name, None)
+    if emulator is not None:
+        emulator.stop()
+    board, emulator = connect(backend, port)
+    if emulator is not None:
+        emulators[name] = emulator
+    return board
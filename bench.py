@@ -0,0 +1,588 @@
+"""
+End-to-end benchmarks of the control stack, headless, against the
+simulated board or the Firmata emulator.
+
+    keyboard    base keys of RobotController to the servo write
+    ps4         X/triangle presses on the PS4 Controller to the first
+                servo write of the pivot
+    scheduler   servo commands per second the ServoScheduler sustains
+                with every servo moving
+    startup     importing robot.py, and mounting the app until the
+                board is connected
+    boards      writes to one of two simulated boards while the other
+                one is well, slow to take writes, and gone
+    server      the control server under load from client processes,
+                one of which never reads its telemetry
+    stall       the stall detector of the PS4 Roboface, on the pivot
+                driven into an obstacle and loaded past its limit
+
+Synthetic input is timestamped where it is injected and again where
+the simulated arm receives the write, so with --emulate the latency
+includes pyfirmata, the pty and the modelled serial line. Each benchmark
+reports p50/p99/max latency, commands per second, serial bytes per
+command (with --emulate) and the CPU time of every thread.
+
+    python bench.py [--emulate] [--out results.json] [--compare old.json]
+
+Results are written as JSON with the commit they were taken at, and
+--compare prints how they changed from an earlier run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'old'))
+
+# alternating keys at KEY_RATE repeat each key further apart than
+# keyhold.REPEAT_GAP, so every press is a tap of one degree
+KEY_PRESSES = 150
+KEY_RATE = 15
+PS4_PRESSES = 40
+HOLD = 0.15
+SCHEDULER_TICKS = 5000
+STARTUP_RUNS = 5
+BOARD_WRITES = 100
+BOARD_RATE = 50
+# s the slow board takes for every write
+SLOW_WRITE = 0.25
+SERVER_CLIENTS = 8
+SERVER_DURATION = 5.0
+STALL_RUNS = 5
+# s the pivot moves before it hits the obstacle
+STALL_APPROACH = 0.3
+OUT = 'bench-results.json'
+
+
+class WriteProbe:
+    """
+    Timestamps the servo writes reaching a SimBoard and matches each one
+    with the oldest input still waiting for a write to that pin.
+    """
+    def __init__(self, sim, capacity=4096):
+        self.sim = sim
+        self.waiting = {}
+        self.latency = np.zeros(capacity)
+        self.count = 0
+        self.writes = 0
+        self.command = sim.command
+        sim.command = self.on_command
+
+    def expect(self, pin):
+        self.waiting.setdefault(pin, []).append(time.perf_counter())
+
+    def cancel(self, pin):
+        self.waiting.pop(pin, None)
+
+    def on_command(self, pin, value):
+        now = time.perf_counter()
+        self.command(pin, value)
+        self.writes += 1
+        waiting = self.waiting.get(pin)
+        if waiting:
+            self.latency[self.count % len(self.latency)] = now - waiting.pop(0)
+            self.count += 1
+
+    def close(self):
+        self.sim.command = self.command
+
+    def stats(self):
+        n = min(self.count, len(self.latency))
+        latency = self.latency[:n] * 1e3 if n else np.full(1, np.nan)
+        p50, p99 = np.percentile(latency, [50, 99])
+        return {
+            'samples': n,
+            'latency_p50_ms': float(p50),
+            'latency_p99_ms': float(p99),
+            'latency_max_ms': float(latency.max()),
+        }
+
+
+def thread_cpu():
+    """
+    CPU seconds of every thread of the process by name, from /proc where
+    there is one.
+    """
+    names = {t.native_id: t.name for t in threading.enumerate()}
+    tick = os.sysconf('SC_CLK_TCK')
+    cpu = {}
+    try:
+        tids = os.listdir('/proc/self/task')
+    except OSError:
+        return cpu
+    for tid in tids:
+        try:
+            with open(f'/proc/self/task/{tid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        name = names.get(int(tid), f'native-{tid}')
+        # utime and stime are the 14th and 15th fields
+        cpu[name] = cpu.get(name, 0.0) + (int(fields[11]) + int(fields[12])) / tick
+    return cpu
+
+
+def cpu_since(before):
+    after = thread_cpu()
+    return {
+        name: round(seconds - before.get(name, 0.0), 4)
+        for name, seconds in after.items() if seconds - before.get(name, 0.0) > 0
+    }
+
+
+def emulated(sim):
+    """
+    A pyfirmata board connected to a FirmataEmulator of the SimBoard.
+    """
+    import pyfirmata
+    from emulator import FirmataEmulator
+    # the emulator has no reset to wait for
+    pyfirmata.pyfirmata.BOARD_SETUP_WAIT_TIME = 0.1
+    emulator = FirmataEmulator(sim)
+    return emulator, emulator.start()
+
+
+def line_counters(emulator):
+    if emulator is None:
+        return 0, 0
+    return emulator.rx_bytes, emulator.servo_writes
+
+
+def serial_stats(emulator, before, drain=5.0):
+    """
+    Serial bytes per servo command the emulator received since the
+    counters were taken, after waiting for the line to drain.
+    """
+    if emulator is None:
+        return {}
+    deadline = time.monotonic() + drain
+    while emulator.rx_free > time.monotonic() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    rx_bytes, servo_writes = line_counters(emulator)
+    return {
+        'serial_bytes_per_command': (rx_bytes - before[0]) / max(servo_writes - before[1], 1),
+        'line': emulator.stats(),
+    }
+
+
+def shutdown(robot, emulator):
+    # stops the Iterator reading the port, then the port is closed
+    # before the pty behind it
+    robot.stop()
+    if emulator is not None:
+        robot.board.exit()
+        emulator.stop()
+
+
+def bench_keyboard(emulate, presses=KEY_PRESSES, rate=KEY_RATE):
+    import arms
+    import robot
+    backend = arms.EMULATOR if emulate else arms.SIM
+    result = {'backend': 'emulator' if emulate else 'sim'}
+
+    async def run():
+        app = robot.RobotController(backend)
+        async with app.run_test(headless=True) as pilot:
+            await app.connected.wait()
+            await pilot.pause(0.2)
+            joint = app.joints['base']
+            emulator = app.emulators.get(joint.board)
+            probe = WriteProbe(emulator.board if emulator is not None else app.boards.workers[joint.board].board)
+            pin = int(joint.pin.split(':')[1])
+            up, down = [k for k, (name, _) in app.keymap.items() if name == 'base']
+            counters = line_counters(emulator)
+            cpu = thread_cpu()
+            started = time.perf_counter()
+            for k in range(presses):
+                probe.expect(pin)
+                # back and forth so every press changes the joint
+                app.move_key(up if k % 2 == 0 else down)
+                await asyncio.sleep(1 / rate)
+            elapsed = time.perf_counter() - started
+            await pilot.pause(0.3)
+            probe.close()
+            result.update(probe.stats())
+            result['commands_per_s'] = probe.writes / elapsed
+            result.update(serial_stats(emulator, counters))
+            result['cpu_s'] = cpu_since(cpu)
+
+    asyncio.run(run())
+    return result
+
+
+def bench_startup(runs=STARTUP_RUNS):
+    """
+    How long importing robot.py takes in a fresh interpreter, whether
+    that pulls in numpy or pyfirmata, and how long the app then takes
+    to mount and connect to the simulated arm.
+    """
+    code = (
+        "import sys, time; t = time.perf_counter(); import robot; "
+        "print(time.perf_counter() - t, 'numpy' in sys.modules, 'pyfirmata' in sys.modules)"
+    )
+    imports = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', code], cwd=HERE, capture_output=True, text=True
+        ).stdout.split()
+        imports.append(float(out[0]))
+    result = {
+        'import_s': float(np.median(imports)),
+        'import_loads_numpy': out[1] == 'True',
+        'import_loads_pyfirmata': out[2] == 'True',
+    }
+
+    import robot
+
+    async def run():
+        started = time.perf_counter()
+        app = robot.RobotController()
+        async with app.run_test(headless=True):
+            await app.connected.wait()
+            result['connect_s'] = time.perf_counter() - started
+
+    asyncio.run(run())
+    return result
+
+
+def bench_boards(writes=BOARD_WRITES, rate=BOARD_RATE, slow=SLOW_WRITE):
+    """
+    Every board has its own worker, so how the other board is doing
+    should not show in the latency of the well one. Always runs on
+    in-process simulated boards, the emulator would only add its line.
+    """
+    import boards
+    from arms import simulated_board
+    sims = {'well': simulated_board(), 'other': simulated_board()}
+    gone = threading.Event()
+
+    def opener(name):
+        def open_board():
+            if name == 'other' and gone.is_set():
+                raise OSError('board gone')
+            return sims[name]
+        return open_board
+
+    manager = boards.BoardManager()
+    for name in sims:
+        manager.add(name, opener(name))
+    manager.start()
+    while not manager.connected():
+        time.sleep(0.01)
+    command = sims['other'].command
+
+    def slow_command(pin, value):
+        time.sleep(slow)
+        command(pin, value)
+
+    def lost_command(pin, value):
+        raise OSError('board gone')
+
+    result = {}
+    for phase, other in (('alone', command), ('slow', slow_command), ('gone', lost_command)):
+        sims['other'].command = other
+        if phase == 'gone':
+            gone.set()
+        probe = WriteProbe(sims['well'])
+        for k in range(writes):
+            probe.expect(11)
+            for name in sims:
+                manager.write(name, 'd:11:s', 60 + k % 2 * 60)
+            manager.flush()
+            time.sleep(1 / rate)
+        time.sleep(0.1)
+        probe.close()
+        result[phase] = probe.stats()
+        result[phase]['other'] = manager.workers['other'].state
+    manager.stop(timeout=1.0)
+    return result
+
+
+def bench_server(emulate, clients=SERVER_CLIENTS, duration=SERVER_DURATION):
+    """
+    Target age is from the client sending a TARGETS frame to the server
+    handing it to the board's worker.
+    """
+    import tempfile
+    import instrument
+    import server
+    from arms import EMULATOR, SIM, SENSOR_PINS, load_arm, open_board
+    from boards import BoardManager
+    backend = EMULATOR if emulate else SIM
+    ports, segments = load_arm()
+    emulators = {}
+    boards = BoardManager()
+    for name, port in ports.items():
+        boards.add(name, partial(open_board, backend, port, emulators, name), SENSOR_PINS.values())
+    control = server.ControlServer(boards, segments)
+    boards.start()
+    while not boards.connected():
+        time.sleep(0.01)
+    address = os.path.join(tempfile.mkdtemp(), 'control.sock')
+    result = {'clients': clients}
+
+    async def client(k):
+        # the last client hangs
+        code = (
+            "import asyncio, json, server; print(json.dumps(asyncio.run(server.load("
+            f"{address!r}, {duration}, read={k < clients - 1}, phase={k}))))"
+        )
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, '-c', code, cwd=HERE, stdout=asyncio.subprocess.PIPE
+        )
+        out, _ = await process.communicate()
+        return json.loads(out)
+
+    async def run():
+        await control.start(address)
+        instrument.reset()
+        instrument.enable()
+        cpu = thread_cpu()
+        loads = await asyncio.gather(*[client(k) for k in range(clients)])
+        instrument.enable(False)
+        result['cpu_s'] = cpu_since(cpu)
+        await control.stop()
+        return loads
+
+    loads = asyncio.run(run())
+    count, (p50, p99, top) = server.AGE.percentiles((50, 99, 100))
+    readers = loads[:-1]
+    result.update({
+        'frames_per_s': sum(load['frames_per_s'] for load in loads),
+        'target_age_p50_ms': p50 / 1e3,
+        'target_age_p99_ms': p99 / 1e3,
+        'target_age_max_ms': top / 1e3,
+        'telemetry_age_p50_ms': float(np.median([load['telemetry_age_p50_ms'] for load in readers])),
+        'telemetry_age_p99_ms': max(load['telemetry_age_p99_ms'] for load in readers),
+        'server': control.stats(),
+        'board': boards.stats(),
+    })
+    boards.stop()
+    for emulator in emulators.values():
+        emulator.stop()
+    return result
+
+
+def roboface(emulate, threaded=True):
+    import ps4_servo
+    sim = ps4_servo.simulated_board()
+    emulator = None
+    if emulate:
+        emulator, port = emulated(sim)
+        robot = ps4_servo.Roboface(True, threaded=threaded, port=port)
+    else:
+        robot = ps4_servo.Roboface(False, threaded=threaded)
+        sim = robot.board
+    return robot, sim, emulator
+
+
+def bench_ps4(emulate, presses=PS4_PRESSES, hold=HOLD):
+    import ps4_servo
+    from myPS4 import BUTTON, BUTTONS
+    robot, sim, emulator = roboface(emulate)
+    controller = ps4_servo.Controller(robot)
+    dispatch = controller.dispatcher.dispatch
+    mapping = controller.dispatcher.mapping
+    time.sleep(0.2)
+    probe = WriteProbe(sim)
+    pin = robot.pivot.pin
+    counters = line_counters(emulator)
+    cpu = thread_cpu()
+    started = time.perf_counter()
+    for k in range(presses):
+        # x and triangle turn the pivot one way and back
+        button = BUTTONS['x' if k % 2 == 0 else 'triangle'][mapping]
+        probe.expect(pin)
+        dispatch(BUTTON, button, 1)
+        time.sleep(hold)
+        dispatch(BUTTON, button, 0)
+        probe.cancel(pin)
+        time.sleep(hold / 3)
+    elapsed = time.perf_counter() - started
+    probe.close()
+    result = probe.stats()
+    result['commands_per_s'] = probe.writes / elapsed
+    result.update(serial_stats(emulator, counters))
+    result['cpu_s'] = cpu_since(cpu)
+    result['backend'] = 'emulator' if emulate else 'sim'
+    shutdown(robot, emulator)
+    return result
+
+
+def bench_stall(emulate, runs=STALL_RUNS):
+    """
+    Detection latency is from the first raw sample of the pivot's
+    current that shows the fault (above the stall level, or the limit)
+    to the event; reaction is from the fault appearing on the simulated
+    arm to the event. backed_off counts the runs in which the pivot was
+    stopped and pulled back.
+    """
+    import ps4_servo
+    import stall
+    robot, sim, emulator = roboface(emulate)
+    pivot = robot.pivot
+    events = []
+    robot.detector.connect(events.append)
+    watch = {}
+
+    zero, gain = ps4_servo.CURRENT_SENSORS['A3']
+
+    def on_sample(pin, value, timestamp):
+        if 'level' in watch and 'onset' not in watch and (value - zero) * gain > watch['level']:
+            watch['onset'] = timestamp
+
+    robot.sampler.connect(on_sample, robot.current_sensors[1].sensor)
+    time.sleep(0.3)
+    scenarios = {
+        stall.STALL: stall.STALL_LEVEL,
+        stall.OVERCURRENT: stall.LIMIT,
+    }
+    result = {}
+    cpu = thread_cpu()
+    for kind, level in scenarios.items():
+        detection, reaction, backed_off = [], [], 0
+        for _ in range(runs):
+            events.clear()
+            watch.clear()
+            pivot.start_moving_clockwise()
+            time.sleep(STALL_APPROACH)
+            if kind == stall.STALL:
+                sim.set_limits(pivot.pin, 0, sim.position(pivot.pin) + 1)
+            else:
+                pivot.stop()
+                sim.set_load(pivot.pin, 5.0)
+            watch['level'] = level
+            fault = time.monotonic()
+            deadline = fault + 3.0
+            while not events and time.monotonic() < deadline:
+                time.sleep(0.001)
+            hits = [event for event in events if event.channel == 'A3' and event.kind == kind]
+            if hits and 'onset' in watch:
+                detection.append(hits[0].detected - watch['onset'])
+                reaction.append(hits[0].detected - fault)
+                time.sleep(0.1)
+                backed_off += robot.scheduler.directions[pivot] == 0
+            sim.set_limits(pivot.pin)
+            sim.set_load(pivot.pin, 0.0)
+            pivot.start_moving_counterclockwise()
+            time.sleep(STALL_APPROACH)
+            pivot.stop()
+            time.sleep(stall.WINDOW + 0.1)
+        ms = np.array(detection or [np.nan]) * 1e3
+        result[kind] = {
+            'runs': runs,
+            'detected': len(detection),
+            'backed_off': int(backed_off),
+            'detection_p50_ms': float(np.median(ms)),
+            'detection_max_ms': float(ms.max()),
+            'reaction_p50_ms': float(np.median(np.array(reaction or [np.nan]) * 1e3)),
+        }
+    result['cpu_s'] = cpu_since(cpu)
+    result['backend'] = 'emulator' if emulate else 'sim'
+    shutdown(robot, emulator)
+    return result
+
+
+def bench_scheduler(emulate, ticks=SCHEDULER_TICKS):
+    import ps4_servo
+    # stepped here rather than by the scheduler's thread
+    robot, sim, emulator = roboface(emulate, threaded=False)
+    scheduler = robot.scheduler
+    servos = [robot.base, robot.pivot, robot.elbow, robot.wrist]
+    counters = line_counters(emulator)
+    sent_before = robot.writer.sent
+    cpu = thread_cpu()
+    started = time.perf_counter()
+    for k in range(ticks):
+        if k % 100 == 0:
+            # turn around before the positional servos reach their limits
+            direction = 1 if (k // 100) % 2 == 0 else -1
+            for servo in servos:
+                servo.send_to_cable(direction)
+        # ticks of a second so every tick moves the servos whole degrees
+        scheduler.step(1.0 / ps4_servo.POS_SPEED)
+    elapsed = time.perf_counter() - started
+    for servo in servos:
+        servo.stop()
+    commands = robot.writer.sent - sent_before
+    result = {
+        'ticks_per_s': ticks / elapsed,
+        'commands_per_s': commands / elapsed,
+        'commands': commands,
+        'writer': robot.writer.stats(),
+    }
+    result['cpu_s'] = cpu_since(cpu)
+    result.update(serial_stats(emulator, counters))
+    result['backend'] = 'emulator' if emulate else 'sim'
+    shutdown(robot, emulator)
+    return result
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = flatten(json.load(f))
+    for key, value in flatten(results).items():
+        if key.startswith('meta.') or '.cpu_s.' in key or key not in previous:
+            continue
+        old = previous[key]
+        change = (value - old) / old * 100 if old else float('inf')
+        print(f"{key:45s} {old:12.3f} -> {value:12.3f}  {change:+7.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks of the control stack.")
+    parser.add_argument('--emulate', action='store_true', help="run against the Firmata emulator")
+    parser.add_argument('--out', default=OUT, help="where to write the results")
+    parser.add_argument('--compare', metavar='FILE', help="results of an earlier run to compare with")
+    args = parser.parse_args()
+    emulate, out, previous = args.emulate, args.out, args.compare
+
+    results = {'meta': metadata()}
+    results['meta']['backend'] = 'emulator' if emulate else 'sim'
+    results['scheduler'] = bench_scheduler(emulate)
+    results['ps4'] = bench_ps4(emulate)
+    results['keyboard'] = bench_keyboard(emulate)
+    results['startup'] = bench_startup()
+    results['boards'] = bench_boards()
+    results['server'] = bench_server(emulate)
+    results['stall'] = bench_stall(emulate)
+
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if previous:
+        compare(results, previous)
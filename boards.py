@@ -0,0 +1,302 @@
+"""
+Several Firmata boards driven from one process.
+
+Every board gets a BoardWorker, a thread that opens the board, sends
+the commands staged for it and reads its sensors, and opens the board
+again when it goes away. Commands and sensor values are addressed by
+(board, pin), pin being a pyfirmata pin code such as "d:11:s", and the
+BoardManager routes them to and from the workers.
+
+A board that is slow or gone only holds up its own worker. Commands for
+it are kept, the latest per pin, and sent once it can take them again;
+after it was opened again the last command of every pin is sent anew.
+"""
+from threading import Thread, Event, Lock
+import time
+
+from coalesce import WriteCoalescer
+from sampler import AnalogSampler, INTERVAL
+
+# s between attempts to open a board
+RETRY = 1.0
+# a worker with nothing to send reads its board at least every POLL s
+POLL = 0.005
+# a serial write that takes longer than this counts as the board gone
+WRITE_TIMEOUT = 0.5
+
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+STOPPED = 'stopped'
+
+
+class BoardWorker:
+    def __init__(self, name, open_board, sensors=(), interval=INTERVAL, on_state=None):
+        """
+        open_board() returns the board, is called on the worker's thread
+        and may block or raise until the board is there.
+        """
+        self.name = name
+        self.open_board = open_board
+        self.interval = interval
+        self.on_state = on_state
+        self.sensors = list(sensors)
+        self.consumers = []
+        self.board = None
+        self.pins = {}
+        self.codes = {}
+        self.writer = None
+        self.sampler = None
+        self.polled = 0.0
+        self.lock = Lock()
+        self.pending = {}
+        self.targets = {}
+        self.wake = Event()
+        self.stopped = Event()
+        self.thread = None
+        self.state = None
+        self.error = None
+        self.opened = 0
+        self.lost = 0
+        self.samples = 0
+        self.consumer_errors = 0
+        self.consumer_error = None
+
+    def set_state(self, state):
+        self.state = state
+        if self.on_state is not None:
+            self.on_state(self.name, state)
+
+    def write(self, pin, value):
+        """
+        Stage a value for the pin, sent on the next flush.
+        """
+        with self.lock:
+            self.pending[pin] = value
+            self.targets[pin] = value
+
+    def flush(self):
+        if self.pending:
+            self.wake.set()
+
+    def emit(self, pin, value, timestamp):
+        self.samples += 1
+        address = (self.name, self.codes[pin])
+        for consumer in self.consumers:
+            try:
+                consumer(address, value, timestamp)
+            except Exception as e:
+                # a broken consumer must not take the board down with it,
+                # it is counted and the last error kept for stats()
+                self.consumer_errors += 1
+                self.consumer_error = repr(e)
+
+    def start(self):
+        self.thread = Thread(target=self.run, name=f"board-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.board is None and not self.open():
+                self.stopped.wait(RETRY)
+                continue
+            self.wake.clear()
+            try:
+                self.send()
+                self.receive()
+            except OSError as e:
+                # serial errors, the port gone or a write timing out
+                self.drop(e)
+                continue
+            except Exception as e:
+                # anything else from the board, e.g. pyfirmata choking on
+                # a garbled message: open it afresh rather than end the
+                # thread with the board left looking connected
+                self.drop(e)
+                continue
+            self.wake.wait(POLL)
+        self.close()
+        self.set_state(STOPPED)
+
+    def open(self):
+        self.set_state(CONNECTING)
+        try:
+            board = self.open_board()
+        except Exception as e:
+            self.error = repr(e)
+            self.set_state(DISCONNECTED)
+            return False
+        sp = getattr(board, 'sp', None)
+        if sp is not None:
+            sp.write_timeout = WRITE_TIMEOUT
+        own_handlers(board)
+        self.board = board
+        self.pins = {}
+        self.codes = {}
+        self.writer = WriteCoalescer(board)
+        self.sampler = AnalogSampler(board, interval=self.interval)
+        self.sampler.connect(self.emit)
+        with self.lock:
+            # everything the board was told before, again
+            self.pending = dict(self.targets)
+        self.opened += 1
+        self.error = None
+        self.set_state(CONNECTED)
+        return True
+
+    def pin(self, code):
+        pin = self.pins.get(code)
+        if pin is None:
+            pin = self.board.get_pin(code)
+            self.pins[code] = pin
+            self.codes[pin] = code
+        return pin
+
+    def send(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for code, value in pending.items():
+            self.writer.write(self.pin(code), value)
+        self.writer.flush()
+
+    def receive(self):
+        for code in self.sensors:
+            if code not in self.pins:
+                self.sampler.add(self.pin(code))
+        if self.sampler.reporting:
+            while self.board.bytes_available():
+                self.board.iterate()
+        else:
+            now = time.monotonic()
+            if now - self.polled >= self.interval:
+                self.polled = now
+                self.sampler.poll()
+
+    def drop(self, error):
+        self.error = repr(error)
+        self.lost += 1
+        sp = getattr(self.board, 'sp', None)
+        if sp is not None:
+            try:
+                sp.close()
+            except OSError:
+                pass
+        # pyfirmata's exit(), also run when the board is collected, puts
+        # the servo pins back to output over the port that is gone
+        self.board.__dict__.pop('digital', None)
+        self.board = None
+        self.set_state(DISCONNECTED)
+
+    def close(self):
+        if self.board is None:
+            return
+        try:
+            self.board.exit()
+        except OSError:
+            pass
+        self.board = None
+
+    def stats(self):
+        stats = {
+            'state': self.state,
+            'error': self.error,
+            'opened': self.opened,
+            'lost': self.lost,
+            'samples': self.samples,
+            'consumer_errors': self.consumer_errors,
+            'consumer_error': self.consumer_error,
+        }
+        if self.writer is not None:
+            stats.update(self.writer.stats())
+        return stats
+
+
+def own_handlers(board):
+    """
+    pyfirmata keeps the command handlers in a dict on the Board class,
+    which every board constructed since has written its own handlers
+    into, so all boards would hand their messages to the one set up
+    last. Give the board a dict of its own and fill it with handlers
+    bound to this board.
+    """
+    if not hasattr(board, '_set_default_handlers'):
+        return
+    board._command_handlers = {}
+    board._set_default_handlers()
+
+
+class BoardManager:
+    """
+    The boards by name, each on its own BoardWorker.
+
+        boards = BoardManager()
+        boards.add('left', lambda: pyfirmata.Arduino('/dev/ttyACM0'), sensors=['a:0:i'])
+        boards.connect(show_current, 'left', 'a:0:i')
+        boards.start()
+        boards.write('left', 'd:11:s', 90)
+        boards.flush()
+
+    Consumers are called as consumer((board, pin), value, timestamp) on
+    the thread of the board the value came from.
+    """
+    def __init__(self, interval=INTERVAL, on_state=None):
+        self.interval = interval
+        self.on_state = on_state
+        self.workers = {}
+
+    def add(self, name, open_board, sensors=()):
+        worker = BoardWorker(name, open_board, sensors, self.interval, self.on_state)
+        self.workers[name] = worker
+        return worker
+
+    def connect(self, consumer, board=None, pin=None):
+        """
+        Call consumer for every value of the pin or of every sensor, of
+        the board or of every board.
+        """
+        if board is not None and board not in self.workers:
+            raise ValueError(f"no board {board!r}")
+        consume = consumer
+        if pin is not None:
+            def consume(address, value, timestamp):
+                if address[1] == pin:
+                    consumer(address, value, timestamp)
+        for name, worker in self.workers.items():
+            if board is None or name == board:
+                if pin is not None and pin not in worker.sensors:
+                    worker.sensors.append(pin)
+                worker.consumers.append(consume)
+
+    def write(self, board, pin, value):
+        self.workers[board].write(pin, value)
+
+    def flush(self, board=None):
+        """
+        Wake the workers with commands waiting, of every board or of one.
+        """
+        for name, worker in self.workers.items():
+            if board is None or name == board:
+                worker.flush()
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self, timeout=None):
+        for worker in self.workers.values():
+            worker.stopped.set()
+            worker.wake.set()
+        for worker in self.workers.values():
+            worker.stop(timeout)
+
+    def connected(self):
+        return all(worker.state == CONNECTED for worker in self.workers.values())
+
+    def stats(self):
+        return {name: worker.stats() for name, worker in self.workers.items()}
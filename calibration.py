@@ -0,0 +1,121 @@
+"""
+Calibration engine for the position sensor of a servo.
+
+Instead of sleeping a fixed time after every command and averaging
+repeated reads of pyfirmata's cached value, the engine records every
+analog report of the position pin with its timestamp and moves on as
+soon as the last reports have settled: their spread and their slope
+over the window are both below a tolerance.
+"""
+import time
+
+import numpy as np
+
+from telemetry import TelemetryRing
+
+WINDOW = 8
+TOLERANCE = 0.002
+SLOPE_TOLERANCE = 0.01
+TIMEOUT = 3.0
+CAPACITY = 1024
+
+
+class Settled:
+    def __init__(self, command, value, spread, slope, duration, settled, samples):
+        self.command = command
+        self.value = value
+        self.spread = spread
+        self.slope = slope
+        self.duration = duration
+        self.settled = settled
+        self.samples = samples
+
+    def row(self):
+        return [self.command, self.value, self.spread, self.slope, self.duration, self.settled]
+
+
+def settle_test(samples, tolerance=TOLERANCE, slope_tolerance=SLOPE_TOLERANCE):
+    """
+    samples is an (n, 2) array of timestamps and values. Returns whether
+    they have settled, their standard deviation and their slope in
+    value per second.
+    """
+    t = samples[:, 0] - samples[0, 0]
+    v = samples[:, 1]
+    spread = v.std()
+    if t[-1] > 0:
+        slope = np.polyfit(t, v, 1)[0]
+    else:
+        slope = 0.0
+    return spread <= tolerance and abs(slope) <= slope_tolerance, spread, slope
+
+
+class Calibrator:
+    def __init__(self, servo, position, sampler, window=WINDOW, tolerance=TOLERANCE,
+                 slope_tolerance=SLOPE_TOLERANCE, timeout=TIMEOUT):
+        self.servo = servo
+        self.window = window
+        self.tolerance = tolerance
+        self.slope_tolerance = slope_tolerance
+        self.timeout = timeout
+        self.reports = TelemetryRing(channels=('POSITION',), capacity=CAPACITY)
+        sampler.connect(self.on_sample, position)
+
+    def on_sample(self, pin, value, timestamp):
+        if value is not None:
+            self.reports.write('POSITION', value, timestamp)
+
+    def measure(self, command):
+        """
+        Send the command and wait until the position reports that arrived
+        after it have settled, or until the timeout.
+        """
+        start = time.monotonic()
+        self.servo.write(command)
+        seen = self.reports.count
+        while True:
+            remaining = start + self.timeout - time.monotonic()
+            seen = self.reports.wait(seen, max(remaining, 0))
+            samples = self.reports.since(start, 'POSITION')
+            if len(samples) >= self.window:
+                settled, spread, slope = settle_test(
+                    samples[-self.window:], self.tolerance, self.slope_tolerance)
+                if settled or remaining <= 0:
+                    break
+            elif remaining <= 0:
+                if not len(samples):
+                    raise TimeoutError(f"no position reports after command {command}")
+                settled, spread, slope = False, samples[:, 1].std(), 0.0
+                break
+        last = samples[-self.window:]
+        return Settled(
+            command, last[:, 1].mean(), spread, slope,
+            last[-1, 0] - start, settled, samples
+        )
+
+    def sweep(self, commands):
+        return [self.measure(command) for command in commands]
+
+    def coarse_to_fine(self, low=0, high=180, coarse=10, fine=1, tolerance=0.005):
+        """
+        Sweep every `coarse` steps, then bisect the intervals where the
+        midpoint reading is more than `tolerance` off the straight line
+        between its neighbours, down to `fine` steps. Returns the
+        measurements sorted by command.
+        """
+        commands = list(range(low, high + 1, coarse))
+        if commands[-1] != high:
+            commands.append(high)
+        results = {c: self.measure(c) for c in commands}
+        intervals = list(zip(commands[:-1], commands[1:]))
+        while intervals:
+            a, b = intervals.pop()
+            if b - a <= fine:
+                continue
+            mid = (a + b) // 2
+            results[mid] = self.measure(mid)
+            # the straight line at mid, which is off centre on odd spans
+            expected = results[a].value + (results[b].value - results[a].value) * (mid - a) / (b - a)
+            if abs(results[mid].value - expected) > tolerance:
+                intervals += [(a, mid), (mid, b)]
+        return [results[c] for c in sorted(results)]
@@ -0,0 +1,133 @@
+"""
+Calibration profiles: per board and per joint lookup tables that turn
+raw position readings into degrees and degrees into servo commands.
+
+A profile is stored as calibration/<board>/<joint>.npz, <board> being
+the board's name in arm.json, holding the commands of a calibration
+sweep, the settled raw reading at each of them and the readings at both
+ends of the range. It is loaded once into
+sorted NumPy arrays and looked up with np.interp, which is vectorized
+and a binary search per value.
+
+Loaded profiles are cached and reloaded when their file changes on
+disk. Profiles compiled from calibrate.py's CSV output remember which
+CSV files they came from and are rebuilt when those change.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration')
+SERVO_RANGE = 180
+
+_cache = {}
+
+
+class CalibrationProfile:
+    def __init__(self, command, raw, v_min, v_max, source=''):
+        command = np.asarray(command, dtype=float)
+        raw = np.asarray(raw, dtype=float)
+        self.v_min = float(v_min)
+        self.v_max = float(v_max)
+        self.source = source
+        order = np.argsort(command)
+        self.command = command[order]
+        self.raw = raw[order]
+        # the potentiometer is linear, so the angle follows from the ends
+        degrees = (self.raw - self.v_min) / (self.v_max - self.v_min) * SERVO_RANGE
+        by_raw = np.argsort(self.raw)
+        self._raw_table = self.raw[by_raw]
+        self._deg_from_raw = degrees[by_raw]
+        # np.interp needs increasing x, so noise in the sweep can make the
+        # inverse pick a neighbouring command but never breaks it
+        by_deg = np.argsort(degrees)
+        self._deg_table = degrees[by_deg]
+        self._cmd_from_deg = self.command[by_deg]
+
+    @classmethod
+    def linear(cls, v_min, v_max):
+        """
+        Profile of an ideal servo, for joints that were never calibrated.
+        """
+        return cls([0, SERVO_RANGE], [v_min, v_max], v_min, v_max)
+
+    def to_degrees(self, raw):
+        return np.interp(raw, self._raw_table, self._deg_from_raw)
+
+    def to_command(self, degrees):
+        return np.interp(degrees, self._deg_table, self._cmd_from_deg)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # np.savez appends .npz to names that lack it, write under the
+        # final name through a file object instead
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f, command=self.command, raw=self.raw,
+                v_min=self.v_min, v_max=self.v_max, source=self.source
+            )
+        os.replace(path + '.tmp', path)
+        _cache.pop(path, None)
+
+
+def profile_path(board, joint, directory=CALIBRATION_DIR):
+    return os.path.join(directory, board_key(board), f"{joint}.npz")
+
+
+def board_key(board):
+    """
+    Directory name for a board, its name or the last part of a path.
+    """
+    return os.path.basename(str(board)) or 'default'
+
+
+def load_profile(board, joint, default=None, directory=CALIBRATION_DIR):
+    """
+    The profile of the joint, read from disk only the first time or when
+    the file changed since. Returns default if there is no profile.
+    """
+    path = profile_path(board, joint, directory)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _cache.pop(path, None)
+        return default
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with np.load(path) as data:
+        profile = CalibrationProfile(
+            data['command'], data['raw'], data['v_min'], data['v_max'], str(data['source'])
+        )
+    _cache[path] = (stamp, profile)
+    return profile
+
+
+def fingerprint(*paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def compile_csv(data_csv, measurements_csv, board, joint, directory=CALIBRATION_DIR):
+    """
+    Build the profile of a joint from the data.csv and measurements.csv
+    written by calibrate.py, unless it was already built from the same
+    files.
+    """
+    source = fingerprint(data_csv, measurements_csv)
+    profile = load_profile(board, joint, directory=directory)
+    if profile is not None and profile.source == source:
+        return profile
+
+    v_min, v_max = np.loadtxt(data_csv, delimiter=',')
+    table = np.genfromtxt(measurements_csv, delimiter=',', names=True)
+    # measurements.csv has positions in degrees, go back to raw readings
+    raw = table['x'] / SERVO_RANGE * (v_max - v_min) + v_min
+    profile = CalibrationProfile(table['command'], raw, v_min, v_max, source)
+    profile.save(profile_path(board, joint, directory))
+    return profile
@@ -0,0 +1,97 @@
+"""
+Write coalescing between the joints and the Firmata board.
+
+Joints stage the value they want on their pin. On flush, writes that
+would not change the pin are dropped and the rest go out to the board,
+as a single serial write when every pin is a real pyfirmata servo pin.
+"""
+from threading import Lock
+
+import instrument
+
+ANALOG_MESSAGE = 0xE0
+
+
+class WriteCoalescer:
+    def __init__(self, board=None):
+        self.board = board
+        self.last = {}
+        self.pending = {}
+        self.lock = Lock()
+        self.requested = 0
+        self.sent = 0
+        self.serial_writes = 0
+
+    @property
+    def saved(self):
+        """
+        Number of pin writes that never reached the board.
+        """
+        return self.requested - self.sent
+
+    def write(self, pin, value):
+        """
+        Stage a value for the pin. A later write to the same pin before
+        the next flush replaces it.
+        """
+        with self.lock:
+            self.requested += 1
+            self.pending[pin] = value
+
+    @instrument.timed('writer.flush')
+    def flush(self):
+        with self.lock:
+            changed = [
+                (pin, value) for pin, value in self.pending.items()
+                if self.last.get(pin) != value
+            ]
+            self.pending.clear()
+            for pin, value in changed:
+                self.last[pin] = value
+            self.sent += len(changed)
+        if not changed:
+            return 0
+
+        sp = getattr(self.board, 'sp', None)
+        if sp is not None and all(is_servo_pin(pin) for pin, _ in changed):
+            msg = bytearray()
+            for pin, value in changed:
+                value = int(value)
+                pin.value = value
+                msg += bytes([ANALOG_MESSAGE + pin.pin_number, value % 128, value >> 7])
+            sp.write(msg)
+            self.serial_writes += 1
+        else:
+            for pin, value in changed:
+                pin.write(value)
+            self.serial_writes += len(changed)
+        return len(changed)
+
+    def write_now(self, pin, value):
+        self.write(pin, value)
+        return self.flush()
+
+    def forget(self, pin=None):
+        """
+        Drop the cached value so the next write to the pin is always sent,
+        e.g. after the board was reset.
+        """
+        with self.lock:
+            if pin is None:
+                self.last.clear()
+            else:
+                self.last.pop(pin, None)
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'sent': self.sent,
+            'saved': self.saved,
+            'serial_writes': self.serial_writes,
+        }
+
+
+def is_servo_pin(pin):
+    # pyfirmata marks servo pins with mode SERVO (4); the extended analog
+    # message is needed above pin 15, so those go through pin.write
+    return getattr(pin, 'mode', None) == 4 and getattr(pin, 'pin_number', 16) < 16
@@ -0,0 +1,112 @@
+"""
+Fixed-rate control loop timing on time.monotonic_ns deadlines.
+
+Ticks are due every 1/rate seconds from the moment the loop is reset.
+When a tick is late by more than a period the policy decides what
+happens to the ticks that were missed: SKIP drops them and realigns on
+the next deadline, CATCH_UP runs them back to back. Each tick gets the
+time it stands for, so anything moving at a speed per second moves the
+same distance whatever the policy and the load.
+
+The lateness (jitter) of every tick and by how much it overran its
+period are kept in preallocated arrays for stats().
+"""
+import asyncio
+import time
+
+import numpy as np
+
+SKIP = 'skip'
+CATCH_UP = 'catch-up'
+HISTORY = 1024
+
+
+class ControlLoop:
+    def __init__(self, rate, policy=SKIP, history=HISTORY):
+        assert policy in [SKIP, CATCH_UP]
+        self.rate = rate
+        self.period = int(1e9 / rate)
+        self.policy = policy
+        self.jitter = np.zeros(history, dtype=np.int64)
+        self.overrun = np.zeros(history, dtype=np.int64)
+        self.starts = np.zeros(history, dtype=np.int64)
+        self.ticks = 0
+        self.skipped = 0
+        self.deadline = None
+        self.tick_start = None
+        self.reset()
+
+    def reset(self):
+        """
+        Make the next tick due now, e.g. after the loop was idle.
+        """
+        self.deadline = time.monotonic_ns()
+
+    def _due(self, now):
+        """
+        Time to wait for the next tick in ns, and the seconds it stands for.
+        """
+        late = now - self.deadline
+        ticks = 1
+        if late >= self.period and self.policy == SKIP:
+            missed = late // self.period
+            self.skipped += missed
+            self.deadline += missed * self.period
+            ticks += missed
+        return max(self.deadline - now, 0), ticks * self.period / 1e9
+
+    def _start(self):
+        self.tick_start = time.monotonic_ns()
+        slot = self.ticks % len(self.jitter)
+        self.starts[slot] = self.tick_start
+        self.jitter[slot] = self.tick_start - self.deadline
+
+    def wait(self):
+        """
+        Sleep until the next tick is due and return its length in seconds.
+        """
+        delay, dt = self._due(time.monotonic_ns())
+        if delay:
+            time.sleep(delay / 1e9)
+        self._start()
+        return dt
+
+    async def await_tick(self):
+        delay, dt = self._due(time.monotonic_ns())
+        await asyncio.sleep(delay / 1e9)
+        self._start()
+        return dt
+
+    def done(self):
+        """
+        Mark the end of the work of the current tick.
+        """
+        end = time.monotonic_ns()
+        self.overrun[self.ticks % len(self.overrun)] = max(end - self.deadline - self.period, 0)
+        self.ticks += 1
+        self.deadline += self.period
+
+    def stats(self):
+        n = min(self.ticks, len(self.jitter))
+        jitter = self.jitter[:n] / 1e6
+        overrun = self.overrun[:n] / 1e6
+        if not n:
+            jitter = overrun = np.zeros(1)
+        p50, p90, p99 = np.percentile(jitter, [50, 90, 99])
+        # median interval between ticks, so the pauses of a loop that is
+        # reset after being idle don't count as a slower rate
+        intervals = np.diff(np.sort(self.starts[:n]))
+        achieved = 1e9 / np.median(intervals) if len(intervals) else 0.0
+        p50, p90, p99, achieved = float(p50), float(p90), float(p99), float(achieved)
+        return {
+            'rate': self.rate,
+            'achieved_rate': achieved,
+            'ticks': self.ticks,
+            'skipped': self.skipped,
+            'jitter_p50_ms': p50,
+            'jitter_p90_ms': p90,
+            'jitter_p99_ms': p99,
+            'jitter_max_ms': float(jitter.max()),
+            'overruns': int(np.count_nonzero(overrun)),
+            'overrun_max_ms': float(overrun.max()),
+        }
@@ -0,0 +1,317 @@
+"""
+Firmata emulator on a pseudo-terminal, standing in for the Arduino.
+
+The emulator opens a pty and speaks StandardFirmata on it like an Uno:
+it answers version, firmware, capability and analog mapping queries,
+takes pin modes, servo configuration, servo and digital writes, and
+sends analog reports at the sampling interval. The arm behind it is a
+SimBoard, so servo writes move simulated joints and the reports carry
+their potentiometer and current readings.
+
+A pty moves bytes as fast as they are written, so the serial line is
+modelled: bytes take 10 bits each at the baud rate in either direction,
+and what the host writes faster than that queues up. stats() reports
+the bytes and messages that went through, the queue and how long
+messages waited in it.
+
+pyfirmata connects to it like to a board:
+
+    emulator = FirmataEmulator(simulated_board)
+    emulator.start()
+    board = pyfirmata.Arduino(emulator.port)
+
+Run as a script it serves until interrupted and prints the port.
+"""
+import os
+import selectors
+import sys
+import time
+import tty
+from threading import Thread, Event
+
+import numpy as np
+
+from simboard import SimBoard
+
+BAUDRATE = 57600
+BITS_PER_BYTE = 10
+INTERVAL = 0.019
+DIGITAL_PINS = 20
+ANALOG_PINS = 6
+PWM_PINS = (3, 5, 6, 9, 10, 11)
+DISABLED_PINS = (0, 1)
+FIRMATA_VERSION = (2, 5)
+FIRMWARE = 'StandardFirmata.ino'
+HISTORY = 4096
+
+DIGITAL_MESSAGE = 0x90
+ANALOG_MESSAGE = 0xE0
+REPORT_ANALOG = 0xC0
+REPORT_DIGITAL = 0xD0
+START_SYSEX = 0xF0
+SET_PIN_MODE = 0xF4
+END_SYSEX = 0xF7
+REPORT_VERSION = 0xF9
+SYSTEM_RESET = 0xFF
+
+ANALOG_MAPPING_QUERY = 0x69
+ANALOG_MAPPING_RESPONSE = 0x6A
+CAPABILITY_QUERY = 0x6B
+CAPABILITY_RESPONSE = 0x6C
+EXTENDED_ANALOG = 0x6F
+SERVO_CONFIG = 0x70
+REPORT_FIRMWARE = 0x79
+SAMPLING_INTERVAL = 0x7A
+
+INPUT = 0
+OUTPUT = 1
+ANALOG = 2
+PWM = 3
+SERVO = 4
+
+# data bytes that follow each command, sysex aside
+DATA_BYTES = {
+    DIGITAL_MESSAGE: 2,
+    ANALOG_MESSAGE: 2,
+    REPORT_ANALOG: 1,
+    REPORT_DIGITAL: 1,
+    SET_PIN_MODE: 2,
+    REPORT_VERSION: 0,
+    SYSTEM_RESET: 0,
+}
+
+
+class FirmataEmulator:
+    def __init__(self, board=None, baudrate=BAUDRATE, interval=INTERVAL):
+        self.board = board if board is not None else SimBoard()
+        self.baudrate = baudrate
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.interval = interval
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stopped = Event()
+        self.thread = None
+        self.reset()
+
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.messages = 0
+        self.servo_writes = 0
+        self.max_backlog = 0
+        # how long each message waited on the line, in seconds
+        self.delays = np.zeros(HISTORY)
+
+    def reset(self):
+        self.modes = [OUTPUT] * DIGITAL_PINS
+        self.reporting = np.zeros(ANALOG_PINS, dtype=bool)
+        self.ports = [0] * (DIGITAL_PINS // 8 + 1)
+        self.command = None
+        self.channel = 0
+        self.data = []
+        self.sysex = None
+        # when the line is free again in each direction
+        self.rx_free = self.tx_free = time.monotonic()
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        # like an Uno after its reset
+        self.send(bytes([REPORT_VERSION, *FIRMATA_VERSION]))
+        self.report_firmware()
+        selector = selectors.DefaultSelector()
+        selector.register(self.master, selectors.EVENT_READ)
+        next_report = time.monotonic() + self.interval
+        while not self.stopped.is_set():
+            timeout = max(next_report - time.monotonic(), 0)
+            if selector.select(min(timeout, 0.1)):
+                self.receive(os.read(self.master, 4096))
+            now = time.monotonic()
+            if now >= next_report:
+                self.report_analog()
+                next_report = max(next_report + self.interval, now)
+        selector.close()
+
+    def receive(self, chunk):
+        """
+        Hold the bytes for as long as they take on the line, queued behind
+        the ones before them, then handle them.
+        """
+        now = time.monotonic()
+        start = max(now, self.rx_free)
+        self.rx_free = start + len(chunk) * self.byte_time
+        self.max_backlog = max(self.max_backlog, int(round((self.rx_free - now) / self.byte_time)))
+        self.rx_bytes += len(chunk)
+        arrived = start
+        for byte in chunk:
+            arrived += self.byte_time
+            message = self.parse(byte)
+            if message is None:
+                continue
+            delay = arrived - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.delays[self.messages % HISTORY] = arrived - now
+            self.messages += 1
+            command, channel, data = message
+            if command == START_SYSEX:
+                self.handle_sysex(channel, data)
+            else:
+                self.handle(command, channel, data)
+
+    def send(self, data):
+        """
+        Write the bytes once they have gone over the line, after the ones
+        before them.
+        """
+        now = time.monotonic()
+        self.tx_free = max(now, self.tx_free) + len(data) * self.byte_time
+        if self.tx_free > now:
+            time.sleep(self.tx_free - now)
+        os.write(self.master, data)
+        self.tx_bytes += len(data)
+
+    def parse(self, byte):
+        """
+        Feed one byte to the parser. Returns (command, channel, data) when
+        the byte completes a message; for sysex the channel is the sysex
+        command.
+        """
+        if self.sysex is not None:
+            if byte == END_SYSEX:
+                data, self.sysex = self.sysex, None
+                if data:
+                    return START_SYSEX, data[0], data[1:]
+                return None
+            self.sysex.append(byte)
+            return None
+        if byte & 0x80:
+            if byte == START_SYSEX:
+                self.sysex = []
+                return None
+            command = byte if byte >= START_SYSEX else byte & 0xF0
+            if command not in DATA_BYTES:
+                self.command = None
+                return None
+            self.command, self.channel, self.data = command, byte & 0x0F, []
+        elif self.command is None:
+            return None
+        else:
+            self.data.append(byte)
+        if len(self.data) < DATA_BYTES[self.command]:
+            return None
+        command, self.command = self.command, None
+        return command, self.channel, self.data
+
+    def handle(self, command, channel, data):
+        if command == ANALOG_MESSAGE:
+            self.analog_write(channel, data[0] | data[1] << 7)
+        elif command == DIGITAL_MESSAGE:
+            self.ports[channel] = data[0] | data[1] << 7
+        elif command == REPORT_ANALOG:
+            if channel < ANALOG_PINS:
+                self.reporting[channel] = bool(data[0])
+        elif command == SET_PIN_MODE:
+            if data[0] < DIGITAL_PINS:
+                self.modes[data[0]] = data[1]
+        elif command == REPORT_VERSION:
+            self.send(bytes([REPORT_VERSION, *FIRMATA_VERSION]))
+        elif command == SYSTEM_RESET:
+            self.reset()
+
+    def handle_sysex(self, command, data):
+        if command == REPORT_FIRMWARE:
+            self.report_firmware()
+        elif command == CAPABILITY_QUERY:
+            self.send_sysex(CAPABILITY_RESPONSE, self.capabilities())
+        elif command == ANALOG_MAPPING_QUERY:
+            mapping = [
+                pin - (DIGITAL_PINS - ANALOG_PINS) if pin >= DIGITAL_PINS - ANALOG_PINS else 0x7F
+                for pin in range(DIGITAL_PINS)
+            ]
+            self.send_sysex(ANALOG_MAPPING_RESPONSE, mapping)
+        elif command == SERVO_CONFIG:
+            if data and data[0] < DIGITAL_PINS:
+                self.modes[data[0]] = SERVO
+        elif command == EXTENDED_ANALOG:
+            if data:
+                value = sum(b << (7 * k) for k, b in enumerate(data[1:]))
+                self.analog_write(data[0], value)
+        elif command == SAMPLING_INTERVAL:
+            if len(data) >= 2:
+                self.interval = max((data[0] | data[1] << 7) / 1000, 0.001)
+
+    def analog_write(self, pin, value):
+        if pin < DIGITAL_PINS and self.modes[pin] == SERVO:
+            self.board.command(pin, value)
+            self.servo_writes += 1
+
+    def capabilities(self):
+        data = []
+        for pin in range(DIGITAL_PINS):
+            if pin not in DISABLED_PINS:
+                data += [INPUT, 1, OUTPUT, 1]
+                if pin >= DIGITAL_PINS - ANALOG_PINS:
+                    data += [ANALOG, 10]
+                if pin in PWM_PINS:
+                    data += [PWM, 8]
+                data += [SERVO, 14]
+            data.append(0x7F)
+        return data
+
+    def report_firmware(self):
+        name = []
+        for c in FIRMWARE:
+            name += [ord(c) & 0x7F, ord(c) >> 7]
+        self.send_sysex(REPORT_FIRMWARE, [*FIRMATA_VERSION, *name])
+
+    def send_sysex(self, command, data):
+        self.send(bytes([START_SYSEX, command, *data, END_SYSEX]))
+
+    def report_analog(self):
+        pins = np.flatnonzero(self.reporting)
+        if not len(pins):
+            return
+        values = np.round(self.board.analogs()[pins] * 1023).astype(int)
+        msg = bytearray()
+        for pin, value in zip(pins, values):
+            msg += bytes([ANALOG_MESSAGE | int(pin), value & 0x7F, value >> 7])
+        self.send(bytes(msg))
+
+    def stats(self):
+        n = min(self.messages, HISTORY)
+        delays = self.delays[:n] * 1e3 if n else np.zeros(1)
+        return {
+            'baudrate': self.baudrate,
+            'rx_bytes': self.rx_bytes,
+            'tx_bytes': self.tx_bytes,
+            'messages': self.messages,
+            'servo_writes': self.servo_writes,
+            'max_backlog_bytes': self.max_backlog,
+            'line_delay_mean_ms': float(delays.mean()),
+            'line_delay_max_ms': float(delays.max()),
+        }
+
+
+if __name__ == "__main__":
+    baudrate = int(sys.argv[1]) if len(sys.argv) > 1 else BAUDRATE
+    emulator = FirmataEmulator(baudrate=baudrate)
+    emulator.start()
+    print('Firmata emulator on', emulator.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    print(emulator.stats())
+    emulator.stop()
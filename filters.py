@@ -0,0 +1,83 @@
+"""
+Streaming filters for sensor values.
+
+Every filter takes one sample at a time through update(value, timestamp)
+and returns the filtered value, at a constant cost per sample and with
+all of its state allocated up front. filtered() puts a chain of them in
+front of an AnalogSampler consumer.
+"""
+from bisect import bisect_left, insort
+
+
+class EMA:
+    """
+    Exponential moving average; a smaller alpha smooths more.
+    """
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value, timestamp=None):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class MovingMedian:
+    """
+    Median of the last `size` samples. Removes spikes without the lag of
+    averaging; the cost per sample depends on the window size only.
+    """
+    def __init__(self, size=5):
+        self.size = size
+        self.ring = [0.0] * size
+        self.ordered = []
+        self.count = 0
+
+    def update(self, value, timestamp=None):
+        slot = self.count % self.size
+        if self.count >= self.size:
+            del self.ordered[bisect_left(self.ordered, self.ring[slot])]
+        self.ring[slot] = value
+        insort(self.ordered, value)
+        self.count += 1
+        n = len(self.ordered)
+        if n % 2:
+            return self.ordered[n // 2]
+        return (self.ordered[n // 2 - 1] + self.ordered[n // 2]) / 2
+
+
+class RateLimiter:
+    """
+    Lets the value change by at most `rate` per second, using the sample
+    timestamps.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.value = None
+        self.timestamp = None
+
+    def update(self, value, timestamp):
+        if self.value is None:
+            self.value = value
+        else:
+            limit = self.rate * (timestamp - self.timestamp)
+            self.value += max(-limit, min(limit, value - self.value))
+        self.timestamp = timestamp
+        return self.value
+
+
+def filtered(consumer, *filters):
+    """
+    Wrap a consumer(pin, value, timestamp) so it receives the value run
+    through the filters in order. Samples without a value are dropped.
+    """
+    def consume(pin, value, timestamp):
+        if value is None:
+            return
+        for f in filters:
+            value = f.update(value, timestamp)
+        consumer(pin, value, timestamp)
+    return consume
@@ -0,0 +1,193 @@
+"""
+Named timing spans with log-scale histograms, cheap enough for the hot
+paths.
+
+A span times the block it wraps with time.perf_counter_ns and counts
+the duration in a fixed set of buckets, four per power of two, from
+1 ns up. Every thread counts into its own buckets, so recording takes
+no lock; percentiles() adds the threads' buckets up when asked.
+
+Spans only time anything while instrumentation is enabled; disabled,
+a span costs a check of a global, and a timed function one extra call.
+
+    WRITE = instrument.span('joint.write')
+
+    with WRITE:
+        ...
+
+    @instrument.timed('robot.update')
+    def update(...):
+        ...
+"""
+import time
+from bisect import bisect_left
+from functools import wraps
+from itertools import accumulate
+from threading import local, Lock
+
+SUB_BUCKETS = 4
+BUCKETS = 64 * SUB_BUCKETS
+
+
+def bucket(ns):
+    """
+    Bucket of a duration in ns: exact below 4 ns, then four buckets per
+    power of two.
+    """
+    b = ns.bit_length()
+    if b < 3:
+        return ns
+    return (b - 2) * SUB_BUCKETS + ((ns >> (b - 3)) & 3)
+
+
+def _upper_bounds():
+    bounds = []
+    for i in range(BUCKETS):
+        if i < SUB_BUCKETS:
+            bounds.append(i + 1)
+        else:
+            b = i // SUB_BUCKETS + 2
+            bounds.append((SUB_BUCKETS + 1 + i % SUB_BUCKETS) << (b - 3))
+    return bounds
+
+
+# the longest duration each bucket counts, in ns
+UPPER = _upper_bounds()
+
+
+class _Local(local):
+    # defaults, so a thread that hasn't set them yet reads them without
+    # a failed lookup
+    counts = None
+    start = None
+
+
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.local = _Local()
+        self.shards = []
+        self.lock = Lock()
+
+    def _counts(self):
+        # the first record of a thread makes its buckets, the only time
+        # the lock is taken
+        counts = [0] * BUCKETS
+        with self.lock:
+            self.shards.append(counts)
+        self.local.counts = counts
+        return counts
+
+    def record(self, ns):
+        counts = self.local.counts or self._counts()
+        counts[bucket(ns)] += 1
+
+    def counts(self):
+        with self.lock:
+            shards = list(self.shards)
+        return [sum(column) for column in zip(*shards)] or [0] * BUCKETS
+
+    def reset(self):
+        with self.lock:
+            for counts in self.shards:
+                counts[:] = [0] * BUCKETS
+
+    def percentiles(self, qs=(50, 90, 99, 100)):
+        """
+        The count and the given percentiles in µs, each the top of the
+        bucket it falls in.
+        """
+        cumulative = list(accumulate(self.counts()))
+        total = cumulative[-1]
+        if not total:
+            return total, [0.0] * len(qs)
+        ranks = [min(max(-(-q * total // 100), 1), total) for q in qs]
+        return total, [UPPER[bisect_left(cumulative, rank)] / 1e3 for rank in ranks]
+
+
+class Span:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.local = _Local()
+
+    def __enter__(self):
+        if ON:
+            self.local.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if ON:
+            start = self.local.start
+            if start is not None:
+                self.histogram.record(time.perf_counter_ns() - start)
+                self.local.start = None
+
+
+ON = False
+HISTOGRAMS = {}
+
+
+def histogram(name):
+    if name not in HISTOGRAMS:
+        HISTOGRAMS[name] = Histogram(name)
+    return HISTOGRAMS[name]
+
+
+def span(name):
+    return Span(histogram(name))
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the named span.
+    """
+    def decorator(f):
+        hist = histogram(name)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not ON:
+                return f(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                hist.record(time.perf_counter_ns() - start)
+        return wrapper
+    return decorator
+
+
+def enable(on=True):
+    global ON
+    ON = on
+
+
+def reset():
+    for hist in list(HISTOGRAMS.values()):
+        hist.reset()
+
+
+def snapshot(qs=(50, 90, 99, 100)):
+    """
+    {name: (count, [percentiles in µs])} of every span that has counted
+    anything.
+    """
+    stats = {}
+    for name, hist in sorted(HISTOGRAMS.items()):
+        count, values = hist.percentiles(qs)
+        if count:
+            stats[name] = (count, values)
+    return stats
+
+
+def report(qs=(50, 90, 99, 100)):
+    """
+    The snapshot as a table of lines.
+    """
+    header = f"{'span':24s} {'count':>8s}" + "".join(
+        f" {'max' if q == 100 else f'p{q}':>9s}" for q in qs
+    )
+    lines = [header + "   (µs)"]
+    for name, (count, values) in snapshot(qs).items():
+        lines.append(f"{name:24s} {count:8d}" + "".join(f" {v:9.1f}" for v in values))
+    return lines
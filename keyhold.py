@@ -0,0 +1,81 @@
+"""
+Key presses turned into joint velocities.
+
+A terminal only reports key presses, and repeats them while a key is
+held. Each press on its own is a tap and moves its joint one step.
+Presses that follow each other faster than anyone taps are the
+terminal repeating a held key: from then on the joint moves at a speed
+that ramps up from START_SPEED by ACCEL up to MAX_SPEED, whatever the
+repeat rate, until the repeats stop.
+
+step() is called once per control tick and returns how many whole
+degrees each joint moves on it, with the intents for both directions
+of a joint added together.
+"""
+TAP_STEP = 1
+# deg/s, deg/s^2
+START_SPEED = 20.0
+ACCEL = 90.0
+MAX_SPEED = 120.0
+# presses less than REPEAT_GAP s apart make a hold, which ends
+# RELEASE_GAP s after the last repeat
+REPEAT_GAP = 0.1
+RELEASE_GAP = 0.15
+
+
+class Intent:
+    def __init__(self, now):
+        self.last = now
+        self.held_since = None
+        self.taps = 1
+        self.carry = 0.0
+
+
+class KeyHold:
+    def __init__(self, start_speed=START_SPEED, accel=ACCEL, max_speed=MAX_SPEED):
+        self.start_speed = start_speed
+        self.accel = accel
+        self.max_speed = max_speed
+        self.intents = {}
+
+    def __bool__(self):
+        return bool(self.intents)
+
+    def press(self, joint, direction, now):
+        intent = self.intents.get((joint, direction))
+        if intent is None:
+            self.intents[(joint, direction)] = Intent(now)
+            return
+        if intent.held_since is None:
+            if now - intent.last < REPEAT_GAP:
+                intent.held_since = now
+            else:
+                intent.taps += 1
+        intent.last = now
+
+    def release(self, joint=None):
+        """
+        Drop the intents of a joint, or of every joint.
+        """
+        for key in list(self.intents):
+            if joint is None or key[0] == joint:
+                del self.intents[key]
+
+    def speed(self, intent, now):
+        return min(self.start_speed + self.accel * (now - intent.held_since), self.max_speed)
+
+    def step(self, now, dt):
+        deltas = {}
+        for (joint, direction), intent in list(self.intents.items()):
+            held = intent.held_since is not None
+            if held:
+                intent.carry += self.speed(intent, now) * dt
+            intent.carry += intent.taps * TAP_STEP
+            intent.taps = 0
+            if now - intent.last > (RELEASE_GAP if held else REPEAT_GAP):
+                del self.intents[(joint, direction)]
+            whole = int(intent.carry)
+            if whole:
+                intent.carry -= whole
+                deltas[joint] = deltas.get(joint, 0) + direction * whole
+        return {joint: delta for joint, delta in deltas.items() if delta}
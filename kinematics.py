@@ -0,0 +1,281 @@
+"""
+Forward and inverse kinematics of the arm.
+
+The base turns the arm about the vertical axis; link1, link2 and link3
+pitch in the vertical plane that the base points to. Joint values are
+servo degrees, turned into joint angles with the offset and direction
+of each joint in arm.json, which also holds the link lengths (mm) and
+the servo limits.
+
+forward() works on a batch of joint vectors at once. inverse() solves a
+batch of target points with damped least squares, each one started
+from the nearest pose of a precomputed map of the reachable workspace
+(or from a given seed, e.g. the current pose when jogging). The map is
+built once per configuration and cached on disk.
+
+Damped least squares can get stuck against a joint limit, so a point
+not reached from the map's pose is solved again from the RESTARTS
+poses of the map's grid nearest to it, and the best solution kept. The
+distance left to every point is returned; with strict=True a point
+left further than TOLERANCE away raises Unreachable.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARM_CONFIG = os.path.join(HERE, 'arm.json')
+CACHE_DIR = os.path.join(HERE, '.cache')
+JOINTS = ('base', 'link1', 'link2', 'link3')
+GRID_STEP = 5
+CELL = 5.0
+SEARCH_CELLS = 10
+# most points are solved in a few iterations, the cap is for the rest
+IK_ITERATIONS = 100
+DAMPING = 1.0
+# mm; points closer than TOLERANCE count as reached, PRECISION is where
+# the iterations stop
+TOLERANCE = 0.5
+PRECISION = 0.01
+RESTARTS = 16
+
+
+class Unreachable(ValueError):
+    pass
+
+
+class Arm:
+    def __init__(self, config=ARM_CONFIG, cache_dir=CACHE_DIR):
+        with open(config) as f:
+            cfg = json.load(f)
+        links = cfg['links']
+        self.base_height = float(links['base_height'])
+        self.lengths = np.array([links[name] for name in JOINTS[1:]], dtype=float)
+        joints = [cfg['joints'][name] for name in JOINTS]
+        self.offset = np.array([j['offset'] for j in joints], dtype=float)
+        self.direction = np.array([j['direction'] for j in joints], dtype=float)
+        self.lower = np.array([j['min'] for j in joints], dtype=float)
+        self.upper = np.array([j['max'] for j in joints], dtype=float)
+        angles = np.radians(self.direction * (np.stack([self.lower, self.upper]) - self.offset))
+        self.angle_lower = angles.min(axis=0)
+        self.angle_upper = angles.max(axis=0)
+        # only what shapes the workspace, not ports or key bindings
+        shape = {'links': cfg['links'], 'joints': cfg['joints']}
+        self.fingerprint = hashlib.sha1(json.dumps(shape, sort_keys=True).encode()).hexdigest()
+        self.cache_dir = cache_dir
+        self._workspace = None
+        self._reach = None
+
+    def to_angles(self, q):
+        return np.radians(self.direction * (np.asarray(q, dtype=float) - self.offset))
+
+    def to_servo(self, angles):
+        return np.degrees(angles) * self.direction + self.offset
+
+    def planar(self, pitch):
+        """
+        Reach r and height z of the end of the arm for a batch of link
+        angles (N, 3), and the partial derivatives of both (N, 2, 3).
+        """
+        cum = np.cumsum(pitch, axis=1)
+        dr = self.lengths * np.cos(cum)
+        dz = self.lengths * np.sin(cum)
+        r = dr.sum(axis=1)
+        z = self.base_height + dz.sum(axis=1)
+        # each angle moves every link after it
+        jacobian = np.stack([
+            -np.cumsum(dz[:, ::-1], axis=1)[:, ::-1],
+            np.cumsum(dr[:, ::-1], axis=1)[:, ::-1],
+        ], axis=1)
+        return r, z, jacobian
+
+    def forward(self, q):
+        """
+        End effector positions (N, 3) for servo positions (N, 4) of base,
+        link1, link2 and link3.
+        """
+        angles = self.to_angles(np.atleast_2d(q))
+        r, z, _ = self.planar(angles[:, 1:])
+        yaw = angles[:, 0]
+        return np.stack([r * np.cos(yaw), r * np.sin(yaw), z], axis=1)
+
+    def inverse(self, points, seed=None, iterations=IK_ITERATIONS, strict=False):
+        """
+        Servo positions (N, 4) reaching the points (N, 3), and the distance
+        left to each point (mm). Points out of reach get the closest pose
+        found within the joint limits, or raise Unreachable with strict.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        x, y, z = points.T
+        yaw = np.arctan2(y, x)
+        r = np.hypot(x, y)
+        # reach backwards when the base can't turn far enough
+        base = np.degrees(yaw) * self.direction[0] + self.offset[0]
+        flip = (base < self.lower[0]) | (base > self.upper[0])
+        yaw = np.where(flip, yaw + np.where(yaw > 0, -np.pi, np.pi), yaw)
+        r = np.where(flip, -r, r)
+        target = np.stack([r, z], axis=1)
+
+        if seed is None:
+            pitch = self.to_angles(self.seed(r, z))[:, 1:]
+        else:
+            pitch = self.to_angles(np.atleast_2d(seed))[:, 1:].copy()
+        residual = self.solve(target, pitch, iterations)
+
+        missed = np.flatnonzero(residual >= TOLERANCE)
+        if len(missed) and seed is None:
+            poses = self.workspace()['poses']
+            candidates = self.nearest_poses(target[missed])
+            for k in range(candidates.shape[1]):
+                if not len(missed):
+                    break
+                retry = np.radians(self.direction[1:] * (poses[candidates[:, k]] - self.offset[1:]))
+                left = self.solve(target[missed], retry, iterations)
+                better = left < residual[missed]
+                pitch[missed[better]] = retry[better]
+                residual[missed[better]] = left[better]
+                still = left >= TOLERANCE
+                missed, candidates = missed[still], candidates[still]
+
+        if strict and np.any(residual >= TOLERANCE):
+            far = np.flatnonzero(residual >= TOLERANCE)
+            raise Unreachable(
+                f"{len(far)} of {len(points)} points not reached, up to {residual[far].max():.1f} mm off, "
+                f"first {points[far[0]].tolist()}"
+            )
+        angles = np.concatenate([yaw[:, np.newaxis], pitch], axis=1)
+        return self.to_servo(angles), residual
+
+    def solve(self, target, pitch, iterations=IK_ITERATIONS):
+        """
+        Damped least squares from the link angles (N, 3) towards the (r, z)
+        targets, in place, until every target is within PRECISION or after
+        the given iterations; only the targets not yet there are worked
+        on. Returns the distance left to each target.
+        """
+        identity = np.eye(2) * DAMPING ** 2
+        pr, pz, _ = self.planar(pitch)
+        residual = np.hypot(target[:, 0] - pr, target[:, 1] - pz)
+        active = np.flatnonzero(residual >= PRECISION)
+        for _ in range(iterations):
+            if not len(active):
+                break
+            current = pitch[active]
+            pr, pz, jacobian = self.planar(current)
+            error = target[active] - np.stack([pr, pz], axis=1)
+            jjt = jacobian @ jacobian.transpose(0, 2, 1) + identity
+            step = np.linalg.solve(jjt, error[:, :, np.newaxis])
+            current += (jacobian.transpose(0, 2, 1) @ step)[:, :, 0]
+            np.clip(current, self.angle_lower[1:], self.angle_upper[1:], out=current)
+            pitch[active] = current
+            pr, pz, _ = self.planar(current)
+            left = np.hypot(target[active, 0] - pr, target[active, 1] - pz)
+            residual[active] = left
+            active = active[left >= PRECISION]
+        return residual
+
+    def jog(self, q, delta):
+        """
+        Servo positions moving the end effector of pose q by delta (mm),
+        solved from q itself so it is cheap enough for every tick.
+        """
+        q = np.atleast_2d(np.asarray(q, dtype=float))
+        return self.inverse(self.forward(q) + delta, seed=q)
+
+    def workspace(self):
+        """
+        Map of (r, z) cells to a pose reaching into that cell, built from a
+        grid over the link joints and cached per arm configuration.
+        """
+        if self._workspace is not None:
+            return self._workspace
+        path = os.path.join(self.cache_dir, f"workspace-{self.fingerprint}.npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self._workspace = dict(data)
+            return self._workspace
+
+        axes = [np.arange(lo, hi + 1, GRID_STEP) for lo, hi in zip(self.lower[1:], self.upper[1:])]
+        grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        r, z, _ = self.planar(np.radians(self.direction[1:] * (grid - self.offset[1:])))
+        origin = np.array([r.min(), z.min()])
+        cells = np.floor((np.stack([r, z], axis=1) - origin) / CELL).astype(int)
+        shape = cells.max(axis=0) + 1
+        flat = np.ravel_multi_index(cells.T, shape)
+        _, first = np.unique(flat, return_index=True)
+        table = np.full(shape, -1, dtype=np.int32)
+        table.flat[flat[first]] = first
+        self._workspace = {'poses': grid, 'table': table, 'origin': origin}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez(path, **self._workspace)
+        return self._workspace
+
+    def nearest_poses(self, target, count=RESTARTS):
+        """
+        Indices (N, count) of the poses of the workspace grid whose ends
+        are nearest each (r, z) target, nearest first, looked for in
+        growing squares of cells around the target's.
+        """
+        ws = self.workspace()
+        if self._reach is None:
+            poses = ws['poses']
+            r, z, _ = self.planar(np.radians(self.direction[1:] * (poses - self.offset[1:])))
+            reach = np.stack([r, z], axis=1)
+            cells = np.floor((reach - ws['origin']) / CELL).astype(int)
+            flat = np.ravel_multi_index(cells.T, ws['table'].shape)
+            order = np.argsort(flat, kind='stable')
+            self._reach = (reach, order, flat[order])
+        reach, order, flat = self._reach
+        shape = np.array(ws['table'].shape)
+        count = min(count, len(reach))
+        cells = np.floor((target - ws['origin']) / CELL).astype(int)
+        nearest = np.empty((len(target), count), dtype=int)
+        for k, cell in enumerate(np.clip(cells, 0, shape - 1)):
+            for d in range(1, SEARCH_CELLS + 1):
+                lo = np.maximum(cell - d, 0)
+                hi = np.minimum(cell + d, shape - 1)
+                # the cells of one row of the square are consecutive in flat
+                rows = np.arange(lo[0], hi[0] + 1) * shape[1]
+                first = np.searchsorted(flat, rows + lo[1])
+                last = np.searchsorted(flat, rows + hi[1], side='right')
+                found = np.concatenate([order[a:b] for a, b in zip(first, last)])
+                if len(found) >= count:
+                    break
+            else:
+                found = order
+            distance = np.hypot(*(reach[found] - target[k]).T)
+            nearest[k] = found[np.argsort(distance)[:count]]
+        return nearest
+
+    def seed(self, r, z):
+        """
+        Servo positions (N, 4) from the workspace map near each (r, z);
+        the base is left at its offset, inverse() sets it.
+        """
+        ws = self.workspace()
+        table = ws['table']
+        cells = np.floor((np.stack([r, z], axis=1) - ws['origin']) / CELL).astype(int)
+        clipped = np.clip(cells, 0, np.array(table.shape) - 1)
+        index = table[clipped[:, 0], clipped[:, 1]]
+        for k in np.flatnonzero(index < 0):
+            index[k] = nearest(table, clipped[k])
+        seeds = np.empty((len(index), 4))
+        seeds[:, 0] = self.offset[0]
+        seeds[:, 1:] = np.where(index[:, np.newaxis] >= 0, ws['poses'][index], (self.lower + self.upper)[1:] / 2)
+        return seeds
+
+
+def nearest(table, cell):
+    """
+    Index of a filled cell in growing squares around an empty one.
+    """
+    for d in range(1, SEARCH_CELLS + 1):
+        lo = np.maximum(cell - d, 0)
+        hi = cell + d + 1
+        found = table[lo[0]:hi[0], lo[1]:hi[1]]
+        found = found[found >= 0]
+        if len(found):
+            return found[0]
+    return -1
@@ -1,23 +1,46 @@
 """
 Test script to allow calibrating the position sensor.
 """
+import os
+import sys
 import time
 import math
-import pandas as pd
 
+import numpy as np
 from pynput.keyboard import Key, Listener
 import pyfirmata
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from arms import SENSOR_PINS, base_segment, load_arm
+from calibration import Calibrator
+from calprofile import compile_csv
+from sampler import AnalogSampler
+
 myval = 90
 step = 1
 
-board = pyfirmata.Arduino('/dev/ttyACM')
+# the base of the board as it is named in arm.json, the first board
+# unless given; the profile is kept under that name, where the UI looks
+# for it, and made from the same servo and pot the UI reads
+PORTS, SEGMENTS = load_arm()
+BOARD = sys.argv[1] if len(sys.argv) > 1 else next(iter(PORTS))
+PORT = PORTS[BOARD]
+SERVO_PIN = base_segment(SEGMENTS, BOARD)['pin']
+# joint whose profile is written after the sweep
+JOINT = 'base'
+
+board = pyfirmata.Arduino(PORT)
 it = pyfirmata.util.Iterator(board)
 it.start()
 
-current = board.get_pin('a:0:i')
-position = board.get_pin('a:1:i')
-servo = board.get_pin('d:5:s')
+current = board.get_pin(SENSOR_PINS['current'])
+position = board.get_pin(SENSOR_PINS['base_res'])
+servo = board.get_pin(SERVO_PIN)
+
+# every position report is recorded with its timestamp, so measurements
+# wait for the reading to settle rather than for a fixed time
+sampler = AnalogSampler(board, [current, position])
+calibrator = Calibrator(servo, position, sampler)
 
 
 # initialise the pins with write/read
@@ -63,26 +86,10 @@ def print_data(pos_min=0, pos_max=3.3):
     )
 
 
-def multi_read(component, N):
-    readings = []
-    for i in range(N):
-        value = component.read()
-        if value:
-            readings.append(value)
-        # time.sleep(0.1)
-    return sum(readings)/(len(readings))
-
-
 def pre():
-    # measure position at signal 0
-    N = 100
-    servo.write(180)
-    time.sleep(3)
-    v_max = multi_read(position, N)
-    servo.write(0)
-    time.sleep(3)
-    v_min = multi_read(position, N)
-    time.sleep(3)
+    # measure position at both ends of the range
+    v_max = calibrator.measure(180).value
+    v_min = calibrator.measure(0).value
     with open('data.csv', 'w') as f:
         f.write(f"{v_min}, {v_max}")
 
@@ -103,21 +110,24 @@ def post():
 
 
 def measure(pos_min, pos_max):
-    D = 180
-    N = 10
-    measurements = {}
-    for d in range(D):
-        servo.write(d)
-        time.sleep(2)
-        measurements[d] = sum([get_position(pos_min, pos_max) for _ in range(N)])/N
-
-    data = pd.DataFrame(index=measurements.keys(), data={'x': measurements.values()})
-
-    data.to_csv('measurements.csv')
+    start = time.monotonic()
+    results = calibrator.coarse_to_fine(0, 180)
+    data = np.array([r.row() for r in results], dtype=float)
+    # position in degrees from the raw reading, as get_position does
+    data[:, 1] = (data[:, 1] - pos_min) / (pos_max - pos_min) * 180
+    np.savetxt(
+        'measurements.csv', data, delimiter=',', fmt='%g',
+        header='command,x,spread,slope,settle_time,settled', comments=''
+    )
+    print(
+        f"{len(results)} positions in {time.monotonic() - start:.1f} s,",
+        f"{int(data[:, 5].sum())} settled"
+    )
 
 
 if __name__ == "__main__":
     params = pre()
     # loop(**params)
     measure(**params)
+    compile_csv('data.csv', 'measurements.csv', BOARD, JOINT)
     post()
@@ -1,33 +1,31 @@
 import os
-import time
-import struct
 import datetime
-import threading
 
-# EVENT_SIZE = struct.calcsize("")
+from js_reader import JoystickReader
+
 
-    
 def do(interface):
     assert os.path.exists(interface), "Device must be connected"
     print('Connecting...', end='')
-    handle = open(interface, "rb")
+    reader = JoystickReader(interface)
     print('done!')
     while True:
         try:
-            read(handle)
+            read(reader)
         except KeyboardInterrupt:
             break
+    reader.close()
     print('Interrupted.')
 
 
-def read(handle):
-    raw = handle.read(8)
-    *btime, value, btype, bid = struct.unpack("3Bh2b", raw)
- 
-    print(datetime.datetime.now(), end='')
-    print(
-        f"{value:7d}{btype:5d}{bid:3d} --- {btime}"
-    )
+def read(reader):
+    batch = reader.read()
+    now = datetime.datetime.now()
+    for btime, value, btype, bid in batch.tolist():
+        print(now, end='')
+        print(
+            f"{value:7d}{btype:5d}{bid:3d} --- {list(btime)}"
+        )
 
 if __name__ == "__main__":
     interface = "/dev/input/js0"
@@ -0,0 +1,98 @@
+"""
+Batch reader for the kernel joystick interface (/dev/input/js*).
+
+The device is read non-blocking: the reader waits for it with a
+selector, then takes every pending byte in one go and decodes the whole
+batch with np.frombuffer. Axis events are collapsed so only the latest
+value of each axis in a batch is kept; button events and the events of
+axes marked as discrete are all kept, in order. Any readable file descriptor carrying the same 8 byte events
+(a pipe or a FIFO fed with recorded bytes) works as well.
+"""
+import os
+import selectors
+
+import numpy as np
+
+# same layout as struct format "3Bh2b" with native alignment
+EVENT = np.dtype({
+    'names': ['time', 'value', 'type', 'number'],
+    'formats': [('u1', 3), '=i2', 'i1', 'i1'],
+    'offsets': [0, 4, 6, 7],
+    'itemsize': 8,
+})
+EVENT_BUTTON = 0x01
+EVENT_AXIS = 0x02
+EVENT_INIT = 0x80
+READ_SIZE = 64 * EVENT.itemsize
+
+
+def collapse(batch, discrete=()):
+    """
+    Keep every button event and only the last event of each axis, except
+    for the discrete axes (like the arrow pad) where every step counts.
+    """
+    # the type is signed in "3Bh2b", masking drops the init flag (sign bit)
+    axes = batch['type'] & 0x7F == EVENT_AXIS
+    if len(discrete):
+        axes &= ~np.isin(batch['number'], discrete)
+    axis = np.flatnonzero(axes)
+    if len(axis) < 2:
+        return batch
+    # np.unique gives the first occurrence, so look at the axes backwards
+    _, last = np.unique(batch['number'][axis][::-1], return_index=True)
+    keep = np.ones(len(batch), dtype=bool)
+    keep[axis] = False
+    keep[axis[::-1][last]] = True
+    return batch[keep]
+
+
+class JoystickReader:
+    def __init__(self, interface="/dev/input/js0", fd=None, discrete=()):
+        self.interface = interface
+        self.discrete = np.array(discrete, dtype=np.int8)
+        if fd is None:
+            fd = os.open(interface, os.O_RDONLY | os.O_NONBLOCK)
+        else:
+            os.set_blocking(fd, False)
+        self.fd = fd
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(fd, selectors.EVENT_READ)
+        self.partial = b''
+        self.closed = False
+
+    def fileno(self):
+        return self.fd
+
+    def read_pending(self):
+        chunks = [self.partial]
+        while True:
+            try:
+                chunk = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                # the writer went away or the device was unplugged
+                self.closed = True
+                break
+            chunks.append(chunk)
+        data = b''.join(chunks)
+        whole = len(data) - len(data) % EVENT.itemsize
+        self.partial = data[whole:]
+        return np.frombuffer(data, dtype=EVENT, count=whole // EVENT.itemsize)
+
+    def read(self, timeout=None):
+        """
+        Wait up to timeout seconds for events and return the pending
+        ones, with the axis events collapsed.
+        """
+        if self.closed or not self.selector.select(timeout):
+            return np.empty(0, dtype=EVENT)
+        return collapse(self.read_pending(), self.discrete)
+
+    def __iter__(self):
+        while not self.closed:
+            yield from self.read()
+
+    def close(self):
+        self.selector.close()
+        os.close(self.fd)
@@ -3,6 +3,7 @@
 
 import time
 import os
+import sys
 os.environ["DISPLAY"] = ":0"
 
 import numpy as np
@@ -10,6 +11,9 @@ import numpy as np
 from pynput.keyboard import Key, Listener
 import pyfirmata
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from coalesce import WriteCoalescer
+
 pos_base = 90
 pos_pivot = 90
 pos_elbow = 90
@@ -57,19 +61,24 @@ pivot = board.get_pin('d:10:s')
 elbow = board.get_pin('d:9:s')
 wrist = board.get_pin('d:6:s')
 
+# only positions that changed since the last pass reach the board
+writer = WriteCoalescer(board)
+
 listener = Listener(on_press=on_press)
 listener.start()
 
 while True:
     try:
         print(C(current), '-', pos_base, pos_pivot, pos_elbow, pos_wrist)
-        base.write(pos_base)
-        pivot.write(pos_pivot)
-        elbow.write(pos_elbow)
-        wrist.write(pos_wrist)
+        writer.write(base, pos_base)
+        writer.write(pivot, pos_pivot)
+        writer.write(elbow, pos_elbow)
+        writer.write(wrist, pos_wrist)
+        writer.flush()
     except KeyboardInterrupt:
         break
 
 
 listener.stop()
-print('\nScript exited.')
+print('\nWrites saved:', writer.saved)
+print('Script exited.')
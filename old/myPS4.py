@@ -1,18 +1,57 @@
+import os
 import sys
+import time
 
 from pyPS4Controller.controller import Controller, Event
 
+from js_reader import JoystickReader
+
+BUTTON = 1
+AXIS = 2
+AXIS_MAX = 32767
+
+# button ids as (usb, ds4drv), None where ds4drv doesn't send the button
+BUTTONS = dict(
+    x=(0, 1),
+    circle=(1, 2),
+    triangle=(2, 3),
+    square=(3, 0),
+    L1=(4, 4),
+    R1=(5, 5),
+    share=(8, None),
+    options=(9, 9),
+    playstation_button=(10, None),
+    L3=(11, None),
+    R3=(12, None),
+)
+
+# arrows are axes that only ever take -max, 0 and max:
+# axis ids as (usb, ds4drv) and the events for each of those values
+ARROWS = [
+    ((7, 10), ('up_arrow_press', 'up_down_arrow_release', 'down_arrow_press')),
+    ((6, 9), ('left_arrow_press', 'left_right_arrow_release', 'right_arrow_press')),
+]
+
+# sticks as (x axis, y axis) ids for (usb, ds4drv)
+STICKS = dict(
+    L3=((0, 1), (0, 1)),
+    R3=((3, 4), (2, 5)),
+)
+
+# analog triggers as axis ids for (usb, ds4drv)
+TRIGGERS = dict(
+    L2=(2, 3),
+    R2=(5, 4),
+)
+
 
 class RemappedEvent(Event):
+    KEYMAP = dict(x=0, circle=1, triangle=2, square=3)
+    KEYMAP_DS4DRV = dict(x=1, circle=2, triangle=3, square=0)
+
     def __init__(self, **kwargs):
         Event.__init__(self, **kwargs)
-    
-        self.keymap = dict(
-            x=0 if not self.connecting_using_ds4drv else 1,
-            circle=1 if not self.connecting_using_ds4drv else 2,
-            triangle=2 if not self.connecting_using_ds4drv else 3,
-            square=3 if not self.connecting_using_ds4drv else 0
-        )
+        self.keymap = self.KEYMAP_DS4DRV if self.connecting_using_ds4drv else self.KEYMAP
 
     def x_pressed(self):
         return self.button_id == self.keymap['x'] and self.button_type == 1 and self.value == 1
@@ -39,31 +78,143 @@ class RemappedEvent(Event):
         return self.button_id == self.keymap['circle'] and self.button_type == 1 and self.value == 0
 
 
-# Dummy funcions
-def do_nothing(self, value=None): 
+class Dispatcher:
     """
-    This functions does nothing. It is made to replace
-    all event methods of the Controller class.
+    Maps (button_type, button_id, value) straight to a handler. The table
+    is built once when handlers are registered, so handling a button
+    event is a single dict lookup. Sticks and triggers, whose value
+    varies, are looked up by (button_type, button_id) instead.
     """
-    pass
-
-
-class MuteController(Controller):
+    def __init__(self, connecting_using_ds4drv=True):
+        self.mapping = 1 if connecting_using_ds4drv else 0
+        self.table = {}
+        self.axes = {}
+        self.handlers = {}
+        self.recorder = None
+
+    def on(self, name, handler):
+        """
+        Register the handler for an event named like the on_* methods of
+        pyPS4Controller without the prefix, e.g. 'x_press' or 'L3_left'.
+        """
+        self.handlers[name] = handler
+        self.compile()
+
+    def register(self, target):
+        """
+        Register every on_* method of the target that names an event.
+        """
+        for name in event_names():
+            handler = getattr(target, 'on_' + name, None)
+            if handler is not None:
+                self.handlers[name] = handler
+        self.compile()
+
+    def compile(self):
+        self.table = {}
+        self.axes = {}
+        for button, ids in BUTTONS.items():
+            button_id = ids[self.mapping]
+            if button_id is None:
+                continue
+            self._add((BUTTON, button_id, 1), button + '_press')
+            self._add((BUTTON, button_id, 0), button + '_release')
+        for ids, names in ARROWS:
+            for value, name in zip((-AXIS_MAX, 0, AXIS_MAX), names):
+                self._add((AXIS, ids[self.mapping], value), name)
+        for stick, ids in STICKS.items():
+            x, y = ids[self.mapping]
+            self._add((AXIS, x, 0), stick + '_x_at_rest')
+            self._add((AXIS, y, 0), stick + '_y_at_rest')
+            self._add_axis(x, self.handlers.get(stick + '_left'), self.handlers.get(stick + '_right'))
+            self._add_axis(y, self.handlers.get(stick + '_up'), self.handlers.get(stick + '_down'))
+        for trigger, ids in TRIGGERS.items():
+            axis = ids[self.mapping]
+            self._add((AXIS, axis, -AXIS_MAX), trigger + '_release')
+            press = self.handlers.get(trigger + '_press')
+            if press is not None:
+                self.axes[(AXIS, axis)] = press
+
+    def _add(self, key, name):
+        handler = self.handlers.get(name)
+        if handler is not None:
+            self.table[key] = handler
+
+    def _add_axis(self, axis, negative, positive):
+        if negative is None and positive is None:
+            return
+
+        def handle(value):
+            if value < 0 and negative is not None:
+                negative(value)
+            elif value > 0 and positive is not None:
+                positive(value)
+        self.axes[(AXIS, axis)] = handle
+
+    def dispatch(self, button_type, button_id, value):
+        if self.recorder is not None:
+            self.recorder.input('js', value, button_type, button_id)
+        handler = self.table.get((button_type, button_id, value))
+        if handler is not None:
+            handler()
+            return
+        handler = self.axes.get((button_type, button_id))
+        if handler is not None:
+            handler(value)
+
+
+def event_names():
+    names = []
+    for button in BUTTONS:
+        names += [button + '_press', button + '_release']
+    for _, arrow_names in ARROWS:
+        names += arrow_names
+    for stick in STICKS:
+        names += [stick + suffix for suffix in
+                  ('_left', '_right', '_up', '_down', '_x_at_rest', '_y_at_rest')]
+    for trigger in TRIGGERS:
+        names += [trigger + '_press', trigger + '_release']
+    return names
+
+
+class MuteController:
+    """
+    Does nothing on any event except call the on_* methods a subclass
+    defines, through a Dispatcher compiled from them once. Events are
+    read in batches with JoystickReader.
+    """
+    def __init__(self, interface="/dev/input/js0", connecting_using_ds4drv=True):
+        self.interface = interface
+        self.connecting_using_ds4drv = connecting_using_ds4drv
+        self.stop = False
+        self.dispatcher = Dispatcher(connecting_using_ds4drv)
+        self.dispatcher.register(self)
+
+    def wait_for_interface(self, timeout):
+        print("Waiting for interface: {} to become available . . .".format(self.interface))
+        for _ in range(timeout):
+            if os.path.exists(self.interface):
+                print("Successfully bound to: {}.".format(self.interface))
+                return
+            time.sleep(1)
+        print("Timeout({} sec). Interface not available.".format(timeout))
+        exit(1)
+
+    def listen(self, timeout=30):
+        self.wait_for_interface(timeout)
+        arrows = [ids[self.dispatcher.mapping] for ids, _ in ARROWS]
+        reader = JoystickReader(self.interface, discrete=arrows)
+        dispatch = self.dispatcher.dispatch
+        try:
+            while not self.stop and not reader.closed:
+                for _, value, button_type, button_id in reader.read(0.5).tolist():
+                    dispatch(button_type, button_id, value)
+        finally:
+            reader.close()
 
-    def __init__(self, **kwargs):
-        # Rewrite all methods in Controller class
-        # to do nothing. Only the methods defined
-        # below as methods will do anything.
-        for attr in dir(Controller):
-            if attr.startswith('on_'):  
-                setattr(Controller, attr, do_nothing)
-        # Run the initalisation to define the rest of
-        # the attributes.
-        Controller.__init__(self, **kwargs)
-   
 
 if __name__ == "__main__":
-    usb = (len(sys.argv) > 1 and sys.argv[1] == '--usb')    
+    usb = (len(sys.argv) > 1 and sys.argv[1] == '--usb')
     controller = Controller(
         interface="/dev/input/js0",
         connecting_using_ds4drv=(not usb),
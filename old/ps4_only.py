@@ -1,6 +1,6 @@
 import sys
 
-from myPS4 import RemappedEvent, MuteController
+from myPS4 import MuteController
 
 
 class MyController(MuteController):
@@ -25,8 +25,6 @@ if __name__ == "__main__":
     usb = (len(sys.argv) > 1 and sys.argv[1] == '--usb')    
     controller = MyController(
         interface="/dev/input/js0",
-        connecting_using_ds4drv=(not usb),
-        event_definition=RemappedEvent,
-        event_format="3Bh2b"
+        connecting_using_ds4drv=(not usb)
     )
     controller.listen()
@@ -1,19 +1,188 @@
+import os
 import time
 import sys
-from threading import Thread
-import queue
+import argparse
+import asyncio
+from threading import Thread, Condition
 from abc import abstractmethod
 import numpy as np
 
 import pyfirmata
-from myPS4 import RemappedEvent, MuteController
+from myPS4 import MuteController
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from coalesce import WriteCoalescer
+from aioboard import AsyncBoard
+from telemetry import TelemetryRing
+from sampler import AnalogSampler
+from filters import EMA, MovingMedian, filtered
+from controlloop import ControlLoop
+from recorder import Recorder, Replayer
+from simboard import SimBoard, VirtualClock
+from emulator import FirmataEmulator
+from stall import StallDetector, SUM
+import instrument
 
 DATUM = 90
 CONT_SPEED = 10
-POS_STEP = 1
+# degrees per second
+POS_SPEED = 20
 SERVO_MIN = 0
 SERVO_MAX = 180
-QUEUE_MAXSIZE = -1
+# degrees a positional servo retreats when it stalls
+BACKOFF = 20
+RATE = 20
+SAMPLE_INTERVAL = 0.02
+MONITOR_FPS = 10
+PORT = '/dev/ttyACM0'
+
+# channel shown in each slot of the monitor line and how to format it
+MONITOR_LAYOUT = (
+    ('BASE', "BASE:  {:3.0f}"),
+    ('PIVOT', "PIVOT: {:3.0f}"),
+    ('ELBOW', " ELBOW: {:3.0f}"),
+    ('WRIST', "WRIST: {:3.0f}"),
+    ('A2', "A2: {:1.4f}"),
+    ('A3', "A3: {:1.4f}"),
+    ('A4', "A4: {:1.4f}"),
+    ('A5', "A5: {:1.4f}"),
+)
+CURRENT_CHANNELS = ('A2', 'A3', 'A4', 'A5')
+# reading at no current and amperes per unit of reading of each current
+# sensor, like the one robot.py reads; the stall detector works in amperes
+CURRENT_SENSORS = dict.fromkeys(CURRENT_CHANNELS, (0.5, 2.5))
+MONITOR_FRAME = instrument.span('monitor.frame')
+
+
+class ServoScheduler:
+    """
+    Drives every registered servo from one thread on the ticks of a
+    ControlLoop. The thread sleeps while no servo is moving and is woken as soon
+    as a servo is told to start or stop.
+
+    With threaded=False no thread is started and arun() has to be
+    awaited on an event loop instead.
+    """
+    def __init__(self, writer, rate=RATE, threaded=True):
+        self.writer = writer
+        self.clock = ControlLoop(rate)
+        self.directions = {}
+        self.references = {}
+        # the last direction each servo was told to move in
+        self.headings = {}
+        self.pending = set()
+        self.running = True
+        self.condition = Condition()
+        self.loop = None
+        self.wakeup = None
+        self.thread = None
+        if threaded:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def add(self, servo):
+        with self.condition:
+            self.directions[servo] = 0
+            self.references[servo] = DATUM
+
+    def remove(self, servo):
+        with self.condition:
+            self.directions.pop(servo, None)
+            self.references.pop(servo, None)
+            self.headings.pop(servo, None)
+            self.pending.discard(servo)
+
+    def set_direction(self, servo, direction):
+        assert direction in [-1, 0, 1]
+        with self.condition:
+            if servo not in self.directions:
+                return
+            self.directions[servo] = direction
+            if direction:
+                self.headings[servo] = direction
+            self.pending.add(servo)
+            self.condition.notify()
+        self.wake()
+
+    def back_off(self, servo):
+        """
+        Stop the servo and pull it back from where it was heading.
+        """
+        with self.condition:
+            if servo not in self.directions:
+                return
+            self.directions[servo] = 0
+            self.references[servo] = servo.retreat(self.references[servo], self.headings.get(servo, 0))
+            self.pending.add(servo)
+            self.condition.notify()
+        self.wake()
+
+    def wake(self):
+        if self.loop is not None:
+            # may be called from the controller or the sampler thread
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def due(self):
+        """
+        Servos to move on this tick: the ones that are moving plus the
+        ones whose direction changed since the last tick, so a stop is
+        still sent once.
+        """
+        due = [
+            (servo, direction) for servo, direction in self.directions.items()
+            if direction != 0 or servo in self.pending
+        ]
+        self.pending.clear()
+        return due
+
+    def idle(self):
+        return not self.pending and not any(self.directions.values())
+
+    @instrument.timed('scheduler.step')
+    def step(self, dt):
+        # under the lock, so a back_off() from the sampler thread is not
+        # overwritten with a move from the old reference
+        with self.condition:
+            for servo, direction in self.due():
+                self.references[servo] = servo.move(self.references[servo], direction, dt)
+                assert self.references[servo] is not None
+        # all servo moves of one tick go out as one serial write
+        self.writer.flush()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.idle():
+                    self.condition.wait()
+                    self.clock.reset()
+                if not self.running:
+                    return
+            dt = self.clock.wait()
+            self.step(dt)
+            self.clock.done()
+
+    async def arun(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        while True:
+            while self.running and self.idle():
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                self.clock.reset()
+            if not self.running:
+                return
+            dt = await self.clock.await_tick()
+            self.step(dt)
+            self.clock.done()
 
 
 class Servo:
@@ -21,51 +190,30 @@ class Servo:
         self.pin = pin_number
         self.id = identistring
         self.servo = Interface.board.get_pin(f"d:{pin_number}:s")
-        self.report_queue = Interface.report_queue
-        self.queue = queue.Queue(QUEUE_MAXSIZE)
-        self.thread = Thread(target=self.cable, daemon=True)
-        self.thread.start()
+        self.writer = Interface.writer
+        self.telemetry = Interface.telemetry
+        self.recorder = Interface.recorder
+        self.scheduler = Interface.scheduler
+        self.scheduler.add(self)
 
     def send_to_cable(self, value):
-        try:
-            self.queue.put_nowait(value)
-        except queue.Full:
-            print('Queue Full for', self)
-        else:
-            pass
+        self.scheduler.set_direction(self, value)
 
     def close_cable(self):
-        self.queue.put('END')
-        self.thread.join()
-
-    def cable(self):
-        direction = 0
-        reference = DATUM
-        while True:
-            try:
-                direction = self.queue.get_nowait()
-                assert direction in [-1, 0, 1, 'END']
-                if direction == 'END':
-                    print('Closing cable for pin', self.pin)
-                    return
-            except queue.Empty:
-                pass
-            except queue.Full:
-                pass
-            finally:
-                reference = self.move(reference, direction)
-                assert reference is not None
+        print('Closing cable for pin', self.pin)
+        self.scheduler.remove(self)
 
     @abstractmethod
-    def move(self, reference, direction):
+    def move(self, reference, direction, dt):
         """
         Method to be overwritten telling the servo how to handle the
-        given direction. The move method should call send_to_servo
-        and return a reference value.
+        given direction over a tick of dt seconds. The move method
+        should call send_to_servo and return a reference value.
         """
         self.send_to_servo(DATUM)
         return DATUM
 
+    @instrument.timed('servo.send')
     def send_to_servo(self, value):
         if value > SERVO_MAX:
             capped = SERVO_MAX
@@ -73,9 +221,12 @@ class Servo:
             capped = SERVO_MIN
         else:
             capped = value
-        time.sleep(0.05)
-        self.report_queue.put({'id': self.id, 'value': capped})
-        self.servo.write(capped)
+        # the servo takes whole degrees, fractions stay in the reference
+        capped = round(capped)
+        self.telemetry.write(self.id, capped)
+        if self.recorder is not None:
+            self.recorder.command(self.id, capped)
+        self.writer.write(self.servo, capped)
 
     def start_moving_clockwise(self):
         self.send_to_cable(1)
@@ -86,12 +237,22 @@ class Servo:
     def stop(self):
         self.send_to_cable(0)
 
+    def back_off(self):
+        self.scheduler.back_off(self)
+
+    def retreat(self, reference, heading):
+        """
+        The reference to go back to after a stall while heading in that
+        direction.
+        """
+        return reference
+
 
 class Continuous(Servo):
     def __init__(self, Interface, pin, identistring):
         super(Continuous, self).__init__(Interface, pin, identistring)
 
-    def move(self, reference, direction):
+    def move(self, reference, direction, dt):
         self.send_to_servo(DATUM + direction*CONT_SPEED)
         return reference
 
@@ -100,57 +261,76 @@ class Positional(Servo):
     def __init__(self, Interface, pin, identistring):
         super(Positional, self).__init__(Interface, pin, identistring)
 
-    def move(self, reference, direction):
-        new_position = reference+direction*POS_STEP
+    def move(self, reference, direction, dt):
+        new_position = reference + direction*POS_SPEED*dt
+        new_position = max(min(new_position, SERVO_MAX), SERVO_MIN)
         self.send_to_servo(new_position)
         return new_position
 
+    def retreat(self, reference, heading):
+        return max(min(reference - heading*BACKOFF, SERVO_MAX), SERVO_MIN)
+
 
 class AnalogueSensor:
     def __init__(self, Interface, pin_number, identistring):
         self.id = identistring
-        self.report_queue = Interface.report_queue
+        self.telemetry = Interface.telemetry
+        self.recorder = Interface.recorder
         self.sensor = Interface.board.get_pin(f'a:{pin_number}:i')
-        Thread(target=self.periodic_measurement, args=(0.1, ), daemon=True).start()
+        Interface.sampler.connect(
+            filtered(self.on_sample, MovingMedian(5), EMA(0.3)), self.sensor
+        )
 
-    def periodic_measurement(self, delay):
-        while True:
-            self.read()
-            time.sleep(delay)
+    def on_sample(self, pin, value, timestamp):
+        self.telemetry.write(self.id, value, timestamp)
+        if self.recorder is not None:
+            self.recorder.sample(self.id, value, timestamp)
 
     def read(self):
         value = self.sensor.read()
-        self.report_queue.put({'id': self.id, 'value': value})
+        self.telemetry.write(self.id, value)
         return value
 
-class DummyBoard:
-    def get_pin(self, pin):
-        return DummyPin(pin)
-
-
-class DummyPin():
-    def __init__(self, pin):
-        self.pin = pin
-
-    def read(self):
-        # print('Dummy Read - Pin', self.pin)
-        return np.random.rand()
-
-    def write(self, arg):
-        # print('Dummy Write - Pin', self.pin, ':', arg)
-        time.sleep(0.1)
+def simulated_board(speed=1.0):
+    """
+    A SimBoard wired like the arm: the base is a continuous servo and
+    A2 to A5 read the current of base, pivot, elbow and wrist.
+    """
+    board = SimBoard(VirtualClock(speed))
+    board.set_continuous(3)
+    for analog, pin in zip(range(2, 6), [3, 5, 9, 10]):
+        zero, gain = CURRENT_SENSORS[f"A{analog}"]
+        board.wire_current(analog, [pin], zero=zero, gain=1 / gain)
+    return board
 
 
 class Roboface:
-    def __init__(self, enabled=False):
+    """
+    With threaded=False the board, the servos and the sensors are driven
+    from an asyncio event loop by awaiting serve(), without helper threads.
+
+    Commands, samples and controller input are logged to the recorder
+    when one is given. Unless enabled the arm is simulated, with its
+    physics running speed times faster than wall time. port is the
+    serial port of the board, e.g. that of a FirmataEmulator.
+    """
+    def __init__(self, enabled=False, threaded=True, recorder=None, speed=1.0, port=PORT):
+        self.threaded = threaded
+        self.recorder = recorder
+        self.iterator = None
         if enabled:
-            self.board = pyfirmata.Arduino('/dev/ttyACM0')
-            it = pyfirmata.util.Iterator(self.board)
-            it.start()
+            self.board = pyfirmata.Arduino(port)
+            if threaded:
+                self.iterator = pyfirmata.util.Iterator(self.board)
+                self.iterator.start()
         else:
-            self.board = DummyBoard()
+            self.board = simulated_board(speed)
 
-        self.report_queue = queue.Queue()
+        self.telemetry = TelemetryRing()
+        self.writer = WriteCoalescer(self.board)
+        self.sampler = AnalogSampler(self.board, interval=SAMPLE_INTERVAL)
+        self.transport = AsyncBoard(self.board, self.sampler)
+        self.scheduler = ServoScheduler(self.writer, threaded=threaded)
 
         self.current_sensors = [AnalogueSensor(self, k, f"A{k}") for k in range(2, 6)]
 
@@ -159,54 +339,93 @@ class Roboface:
         self.elbow = Positional(self, 9, 'ELBOW')
         self.wrist = Positional(self, 10, 'WRIST')
 
+        # the detector sees every raw sample of A2 to A5, the current of
+        # base, pivot, elbow and wrist, and backs off the servo that
+        # stalls or draws too much
+        self.guarded = dict(zip(CURRENT_CHANNELS, [self.base, self.pivot, self.elbow, self.wrist]))
+        self.detector = StallDetector(CURRENT_CHANNELS, interval=SAMPLE_INTERVAL)
+        for sensor in self.current_sensors:
+            zero, gain = CURRENT_SENSORS[sensor.id]
+            self.sampler.connect(self.detector.consumer(sensor.id, zero, gain), sensor.sensor)
+        self.detector.connect(self.on_stall)
+        if threaded:
+            self.sampler.start()
+
+    async def serve(self):
+        await asyncio.gather(
+            self.transport.run(),
+            self.scheduler.arun(),
+        )
+
+    def on_stall(self, event):
+        """
+        Back off the servo of the channel, or every servo when it was the
+        sum of them all.
+        """
+        if event.channel == SUM:
+            servos = self.guarded.values()
+        else:
+            servos = [self.guarded[event.channel]]
+        for servo in servos:
+            servo.back_off()
+
     def read_current(self):
         currents = [s.read() for s in self.current_sensors]
         return currents, np.round(sum(currents), 4)
 
-    def monitor(self):
-        currents = [0, 0, 0, 0]
-        base_speed = 0
-        pivot_pos = 0
-        elbow_pos = 0
-        wrist_pos = 0
+    def monitor(self, fps=MONITOR_FPS):
+        """
+        Print the latest state at a fixed frame rate, however fast the
+        telemetry comes in. Frames that could not be drawn on time are
+        skipped and counted rather than drawn late.
+        """
+        slots = np.array([self.telemetry.index[channel] for channel, _ in MONITOR_LAYOUT])
+        currents = np.array([self.telemetry.index[channel] for channel in CURRENT_CHANNELS])
+        values = np.zeros(len(slots))
+        line = " ".join(
+            [fmt for _, fmt in MONITOR_LAYOUT]
+            + ["SUM: {:1.4f}", "| {:6.1f} msg/s", "| dropped: {:d}", "| stalls: {:d}"]
+        )
+        period = 1 / fps
+        dropped = 0
+        deadline = time.monotonic()
+        seen, seen_at = self.telemetry.count, deadline
         while True:
-            msg = self.report_queue.get()
-            if msg['id'] == 'BASE':
-                base_speed = msg['value']
-            elif msg['id'] == 'PIVOT':
-                pivot_pos = msg['value']
-            elif msg['id'] == 'ELBOW':
-                elbow_pos = msg['value']
-            elif msg['id'] == 'WRIST':
-                wrist_pos = msg['value']
-            elif msg['id'] == 'A2':
-                currents[0] = msg['value']
-            elif msg['id'] == 'A3':
-                currents[1] = msg['value']
-            elif msg['id'] == 'A4':
-                currents[2] = msg['value']
-            elif msg['id'] == 'A5':
-                currents[3] = msg['value']
-            print(
-                " ".join([
-                    f"BASE:  {base_speed:3d}",
-                    f"PIVOT: {pivot_pos:3d}",
-                    f" ELBOW: {elbow_pos:3d}",
-                    f"WRIST: {wrist_pos:3d}",
-                    f"A2: {currents[0]:1.4f}",
-                    f"A3: {currents[1]:1.4f}",
-                    f"A4: {currents[2]:1.4f}",
-                    f"A5: {currents[3]:1.4f}",
-                    f"SUM: {sum(currents):1.4f}",
-                ]),
-                end='\r', flush=True
-            )
+            deadline += period
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = deadline
+            else:
+                missed = int((now - deadline) // period)
+                dropped += missed
+                deadline += missed * period
+            with MONITOR_FRAME:
+                count = self.telemetry.count
+                rate = (count - seen) / (now - seen_at)
+                seen, seen_at = count, now
+                np.take(self.telemetry.latest, slots, out=values)
+                print(
+                    line.format(
+                        *values, self.telemetry.latest[currents].sum(), rate, dropped, self.detector.events
+                    ),
+                    end='\r', flush=True
+                )
 
     def stop(self):
         self.pivot.close_cable()
         self.elbow.close_cable()
         self.base.close_cable()
         self.wrist.close_cable()
+        self.scheduler.close()
+        self.sampler.stop()
+        if self.iterator is not None:
+            # the Iterator ends on the AttributeError, before the board
+            # can be closed under it
+            self.iterator.board = None
+            self.iterator.join()
+        if self.recorder is not None:
+            self.recorder.close()
 
 
 class Controller(MuteController):
@@ -214,11 +433,13 @@ class Controller(MuteController):
     def __init__(self, Roboface, use_ds4drv=True):
         MuteController.__init__(self,
             interface="/dev/input/js0",
-            connecting_using_ds4drv=use_ds4drv,
-            event_definition=RemappedEvent,
-            event_format="3Bh2b"
+            connecting_using_ds4drv=use_ds4drv
         )
         self.robot = Roboface
+        self.dispatcher.recorder = Roboface.recorder
+
+    def replay(self, name, record):
+        self.dispatcher.dispatch(int(record['type']), int(record['number']), int(record['value']))
 
 
     def on_x_press(self):
@@ -268,20 +489,55 @@ class Controller(MuteController):
 
 
 if __name__ == "__main__":
-    usb = (len(sys.argv) > 1 and '--usb' in sys.argv)
-    enabled = (len(sys.argv) > 1 and '--disable-safety' in sys.argv)
-
-    robot = Roboface(enabled)
+    parser = argparse.ArgumentParser(description="Drive the arm with a PS4 controller.")
+    parser.add_argument('--usb', action='store_true', help="the controller is on USB, not ds4drv")
+    parser.add_argument('--disable-safety', action='store_true', help="drive the real board")
+    parser.add_argument('--asyncio', action='store_true', help="run the board and servos on an event loop")
+    parser.add_argument('--record', metavar='LOG', help="save the session")
+    parser.add_argument('--replay', metavar='LOG', help="play a session back instead of listening to the controller")
+    parser.add_argument('--fast', action='store_true', help="replay without waiting")
+    parser.add_argument('--emulate', action='store_true', help="talk Firmata over a pty to a simulated arm")
+    parser.add_argument('--instrument', action='store_true', help="time the hot paths and print the timings on exit")
+    args = parser.parse_args()
+    usb = args.usb
+    enabled = args.disable_safety
+    use_asyncio = args.asyncio
+    record = args.record
+    replay = args.replay
+    fast = args.fast
+    emulate = args.emulate
+    instrument.enable(args.instrument)
+
+    port = PORT
+    if emulate:
+        emulator = FirmataEmulator(simulated_board())
+        port = emulator.start()
+        enabled = True
+
+    recorder = Recorder(record) if record else None
+    robot = Roboface(enabled, threaded=not use_asyncio, recorder=recorder, port=port)
     controller = Controller(robot, not usb)
 
-    Thread(target=controller.listen, daemon=True).start()
+    if replay:
+        player = Replayer(replay)
+        Thread(target=player.play, args=(controller.replay, None if fast else 1.0), daemon=True).start()
+    else:
+        Thread(target=controller.listen, daemon=True).start()
 
 
     try:
         print()
-        robot.monitor()
+        if use_asyncio:
+            Thread(target=robot.monitor, daemon=True).start()
+            asyncio.run(robot.serve())
+        else:
+            robot.monitor()
     except KeyboardInterrupt:
         pass
 
-
+    if recorder is not None:
+        recorder.close()
+    if instrument.ON:
+        print()
+        print("\n".join(instrument.report()))
     print('\nRunning last line')
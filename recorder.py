@@ -0,0 +1,175 @@
+"""
+Append-only binary log of joint commands, sensor samples and input
+events, and a replayer for it.
+
+The log is a file of fixed-size records behind a header, written
+through a memory map: appending a record is a store into mapped memory,
+the kernel writes the pages back on its own. The file grows by
+GROW_RECORDS records at a time. Channels are stored as small ids, their
+names are kept in the header.
+
+The record count is written to the header on flush() and close(), and is
+only a lower bound until the log was closed: the replayer counts the
+records in use past it, since the kind of an unused record is 0.
+"""
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+import numpy as np
+
+COMMAND = 1
+SAMPLE = 2
+INPUT = 3
+
+MAGIC = b'RLOG0001'
+HEADER_SIZE = 4096
+# magic, record size, record count, then the channel names as JSON
+HEADER = struct.Struct('<8sIQ')
+RECORD = np.dtype([
+    ('t', '<f8'),
+    ('value', '<f8'),
+    ('channel', '<u2'),
+    ('kind', 'u1'),
+    ('type', 'i1'),
+    ('number', '<i4'),
+])
+GROW_RECORDS = 1 << 16
+
+
+class Recorder:
+    def __init__(self, path, grow=GROW_RECORDS):
+        self.path = path
+        self.grow = grow
+        self.channels = {}
+        self.count = 0
+        self.lock = Lock()
+        self.file = open(path, 'w+b')
+        self._map(grow)
+        self.write_header()
+
+    def _map(self, capacity):
+        self.capacity = capacity
+        self.file.truncate(HEADER_SIZE + capacity * RECORD.itemsize)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.records = np.ndarray(
+            (capacity,), dtype=RECORD, buffer=self.mmap, offset=HEADER_SIZE
+        )
+
+    def _extend(self):
+        self.records = None
+        self.mmap.close()
+        self._map(self.capacity + self.grow)
+
+    def write_header(self):
+        names = json.dumps(sorted(self.channels, key=self.channels.get)).encode()
+        header = HEADER.pack(MAGIC, RECORD.itemsize, self.count) + names
+        assert len(header) <= HEADER_SIZE, "too many channels for the header"
+        self.mmap[:len(header)] = header
+        self.mmap[len(header):HEADER_SIZE] = bytes(HEADER_SIZE - len(header))
+
+    def channel(self, name):
+        """
+        The id of a channel name, registering it the first time.
+        """
+        channel = self.channels.get(name)
+        if channel is None:
+            with self.lock:
+                channel = self.channels.setdefault(name, len(self.channels))
+                self.write_header()
+        return channel
+
+    def record(self, kind, name, value, type=0, number=0, t=None):
+        channel = self.channel(name)
+        if t is None:
+            t = time.monotonic()
+        with self.lock:
+            if self.file.closed:
+                # late writes from other threads after close()
+                return
+            if self.count == self.capacity:
+                self._extend()
+            self.records[self.count] = (t, value, channel, kind, type, number)
+            self.count += 1
+
+    def command(self, name, value):
+        self.record(COMMAND, name, value)
+
+    def sample(self, name, value, t=None):
+        self.record(SAMPLE, name, value, t=t)
+
+    def input(self, name, value, type=0, number=0):
+        self.record(INPUT, name, value, type, number)
+
+    def flush(self):
+        with self.lock:
+            self.write_header()
+            self.mmap.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.write_header()
+            self.records = None
+            self.mmap.close()
+            self.file.truncate(HEADER_SIZE + self.count * RECORD.itemsize)
+            self.file.close()
+
+
+class Replayer:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        magic, size, count = HEADER.unpack_from(header)
+        assert magic == MAGIC and size == RECORD.itemsize, f"{path} is not a recording"
+        names = header[HEADER.size:].rstrip(b'\0')
+        self.names = json.loads(names) if names else []
+        capacity = (os.path.getsize(path) - HEADER_SIZE) // RECORD.itemsize
+        self.records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+        # records written after the header was, if it was not closed
+        used = self.records['kind'][count:] != 0
+        if used.all():
+            count = capacity
+        else:
+            count += int(np.argmin(used))
+        self.records = self.records[:count]
+
+    def select(self, kinds=(INPUT,)):
+        return self.records[np.isin(self.records['kind'], kinds)]
+
+    def events(self, kinds=(INPUT,)):
+        """
+        (offset in seconds, channel name, record) for every record of the
+        given kinds, in the order they were recorded.
+        """
+        records = self.select(kinds)
+        if not len(records):
+            return
+        start = self.records['t'][0]
+        for record in records:
+            yield record['t'] - start, self.names[record['channel']], record
+
+    def play(self, handler, speed=1.0, kinds=(INPUT,)):
+        """
+        Call handler(name, record) for each record, at the recorded pace
+        divided by speed, or as fast as possible when speed is None.
+        """
+        started = time.monotonic()
+        for offset, name, record in self.events(kinds):
+            if speed:
+                delay = started + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            handler(name, record)
+
+    async def aplay(self, handler, speed=1.0, kinds=(INPUT,)):
+        started = time.monotonic()
+        for offset, name, record in self.events(kinds):
+            if speed:
+                await asyncio.sleep(max(started + offset / speed - time.monotonic(), 0))
+            handler(name, record)
@@ -2,41 +2,57 @@ from textual.app import App, ComposeResult, RenderResult
 from textual.containers import Horizontal
 from textual.widgets import Static, Label
 from textual.reactive import reactive
-import pyfirmata
-from threading import Thread
-import random
+import argparse
+import asyncio
 import time
-
-
-MOCK = True
-
-if MOCK is False:
-    board = pyfirmata.Arduino('/dev/ttyACM0')
-    it = pyfirmata.util.Iterator(board)
-    it.start()
-else:
-    board = None
-
-
-class MockPin:
-    def write(self, var):
-        pass
-
-    def read(self):
-        return round(random.random(), 4)
+from functools import partial
+from arms import (
+    ARM_CONFIG, EMULATOR, BOARD, BACKEND, SENSOR_PINS, base_profile, load_arm, open_board
+)
+from boards import BoardManager, CONNECTED
+from filters import EMA, MovingMedian, filtered
+import instrument
+from uibridge import UIBridge
+from keyhold import KeyHold
+
+# pyfirmata and numpy (through the simulated board, the calibration
+# profile, trajectories and the control loop) are only imported once
+# the app mounts and connects, so importing this module stays cheap
+
+# sensors are sampled at POWER_INTERVAL and shown at UI_INTERVAL (s);
+# the displays only redraw what changed, once per UI_INTERVAL
+POWER_INTERVAL = 0.02
+UI_INTERVAL = 0.1
+# held keys move the joints on ticks of this rate (Hz), so at most one
+# write per joint goes out per tick
+CONTROL_RATE = 50
+# log file for the session, and a log whose key presses are played back
+# on start (REPLAY_SPEED None plays them as fast as possible)
+RECORD = None
+REPLAY = None
+REPLAY_SPEED = 1.0
+# how often the instrumentation panel is redrawn while shown (s)
+PANEL_INTERVAL = 0.5
 
 
 class Joint:
-    def __init__(self, board, str_code, start=90, mock=False):
+    def __init__(self, boards, board, str_code, start=90):
         self.pos = start
-        if mock:
-            self.pin = MockPin()
-        else:
-            self.pin = board.get_pin(str_code)
-            self.pin.write(self.pos)
+        self.boards = boards
+        self.board = board
+        self.pin = str_code
+        self.write(self.pos)
 
+    @instrument.timed('joint.write')
     def write(self, val):
-        self.pin.write(val)
+        self.stage(val)
+        self.boards.flush(self.board)
+
+    def stage(self, val):
+        """
+        Queue the value for the next flush of the boards.
+        """
+        self.boards.write(self.board, self.pin, val)
 
 
 class ValueLabel(Label):
@@ -46,124 +62,303 @@ class ValueLabel(Label):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    @instrument.timed('ui.render')
     def render(self):
         return f"{self.pos}"
 
 
+class InstrumentPanel(Static):
+    """
+    Percentiles of the instrumented spans, redrawn while shown.
+    """
+    def on_mount(self):
+        self.set_interval(PANEL_INTERVAL, self.refresh_stats)
+
+    def refresh_stats(self):
+        if self.display:
+            self.update("\n".join(instrument.report()))
+
+
 class RobotController(App):
+    """
+    Drives the segments of every board in the segment table. Each board
+    is opened and read on its own worker once the app has mounted; until
+    a board is there its joints keep their latest targets.
+    """
 
     CSS_PATH = "robotcontroller_layout.css"
 
-    segment_labels = [
-        ("base", "Q", "W", "d:11:s", 90),
-        ("link1", "A", "S", "d:10:s", 0),
-        ("link2", "Z", "X", "d:9:s", 180),
-        ("link3", "I", "O", "d:6:s", 180),
-        ("headtwist", "J", "K", "d:5:s", 90),
-        ("claw", "N", "M", "d:3:s", 90)
-    ]
-
-    segments = {
-        label[0]: ValueLabel(classes="box key_value")
-        for label in segment_labels
-    }
-
-    joints = {
-        label[0]: Joint(board, label[3], start=label[4], mock=MOCK)
-        for label in segment_labels
-    }
-
-    volt_disp = ValueLabel(classes="box key_value")
-    curr_disp = ValueLabel(classes="box key_value")
-    base_disp = ValueLabel(classes="box key_value")
-    base_disp_deg = ValueLabel(classes="box key_value")
-
-    if MOCK:
-        current = MockPin()
-        voltage = MockPin()
-        base_res = MockPin()
-    else:
-        current = board.get_pin("a:0:i")
-        voltage = board.get_pin("a:1:i")
-        base_res = board.get_pin("a:2:i")
-
-    def read_power(self):
-        while True:
-            self.curr_disp.pos = round((self.current.read() - 0.5) * 2.5, 2)
-            self.volt_disp.pos = round(self.voltage.read() * 10, 2)
-            self.base_disp.pos = round(self.base_res.read() * 5, 2)
-            self.base_disp_deg.pos = round((self.base_res.read() - 0.064) / (0.58 - 0.064) * 180, 0)
-            # max 0.58
-            # min 0.064
-            time.sleep(0.5)
+    recorder = None
+
+    def __init__(self, backend=BACKEND, config=ARM_CONFIG, ports=None):
+        super().__init__()
+        self.backend = backend
+        self.ports, self.segment_table = load_arm(config)
+        self.ports.update(ports or {})
+        self.limits = {s["name"]: (s["min"], s["max"]) for s in self.segment_table}
+        self.keymap = {}
+        for s in self.segment_table:
+            up, down = s["keys"]
+            self.keymap[up] = (s["name"], 1)
+            self.keymap[down] = (s["name"], -1)
+        self.segments = {
+            s["name"]: ValueLabel(classes="box key_value")
+            for s in self.segment_table
+        }
+        # per board: its state and the sensors
+        self.displays = {
+            name: {
+                key: ValueLabel(classes="box key_value")
+                for key in ("state", "voltage", "current", "base_v", "base_deg")
+            }
+            for name in self.ports
+        }
+        self.instruments = InstrumentPanel(classes="box instruments")
+        self.profiles = {}
+        self.emulators = {}
+        self.boards = BoardManager(interval=POWER_INTERVAL, on_state=self.board_state)
+        for name in self.ports:
+            self.boards.add(name, partial(self.open_board, name), SENSOR_PINS.values())
+        self.joints = {
+            s["name"]: Joint(self.boards, s["board"], s["pin"], start=s["start"])
+            for s in self.segment_table
+        }
+        self.sensor_names = {
+            (board, pin): name if len(self.ports) == 1 else f"{board}.{name}"
+            for board in self.ports
+            for name, pin in SENSOR_PINS.items()
+        }
+        self.keys = KeyHold()
+        self.pressed = None
+        self.connected = None
+        self.loop = None
+
+    @instrument.timed('power.current')
+    def show_current(self, address, value, timestamp):
+        self.bridge.publish((address[0], "current"), round((value - 0.5) * 2.5, 2))
+
+    @instrument.timed('power.voltage')
+    def show_voltage(self, address, value, timestamp):
+        self.bridge.publish((address[0], "voltage"), round(value * 10, 2))
+
+    @instrument.timed('power.position')
+    def show_position(self, address, value, timestamp):
+        board = address[0]
+        self.bridge.publish((board, "base_v"), round(value * 5, 2))
+        degrees = self.profiles[board].to_degrees(value)
+        self.bridge.publish((board, "base_deg"), round(float(degrees), 0))
+
+    def board_state(self, board, state):
+        # on the thread of the board
+        self.bridge.publish((board, "state"), state)
+        if state == CONNECTED and self.boards.connected():
+            self.loop.call_soon_threadsafe(self.connected.set)
+
+    def open_board(self, name):
+        """
+        Open the board, on its worker's thread, whenever the worker needs
+        it open.
+        """
+        self.profiles[name] = base_profile(name)
+        return open_board(self.backend, self.ports[name], self.emulators, name)
+
+    def on_mount(self):
+        self.loop = asyncio.get_running_loop()
+        self.pressed = asyncio.Event()
+        self.connected = asyncio.Event()
+        self.bridge = UIBridge(self, UI_INTERVAL)
+        for board, displays in self.displays.items():
+            for key, widget in displays.items():
+                self.bridge.bind((board, key), widget)
+        self.bridge.start()
+        if RECORD:
+            from recorder import Recorder
+            self.recorder = Recorder(RECORD)
+        # sensor values are filtered on the thread of their board and
+        # handed to the bridge
+        for board in self.ports:
+            self.boards.connect(
+                filtered(self.show_current, MovingMedian(5), EMA(0.2)), board, SENSOR_PINS["current"]
+            )
+            self.boards.connect(filtered(self.show_voltage, EMA(0.1)), board, SENSOR_PINS["voltage"])
+            self.boards.connect(
+                filtered(self.show_position, MovingMedian(5), EMA(0.3)), board, SENSOR_PINS["base_res"]
+            )
+        if self.recorder is not None:
+            self.boards.connect(self.record_sample)
+        self.boards.start()
+        self.run_worker(self.drive(), name="keys")
+        if REPLAY:
+            from recorder import Replayer
+            self.run_worker(Replayer(REPLAY).aplay(self.replay_input, REPLAY_SPEED), name="replay")
+
+    def on_unmount(self):
+        self.boards.stop()
+        for emulator in self.emulators.values():
+            emulator.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def record_sample(self, address, value, timestamp):
+        self.recorder.sample(self.sensor_names[address], value, timestamp)
+
+    def replay_input(self, name, record):
+        if name == "home":
+            self.key_h()
+        else:
+            self.hold(name, int(record['value']))
 
     def compose(self) -> ComposeResult:
-        Thread(target=self.read_power, daemon=True).start()
-
-        for label in self.segment_labels:
-            self.segments[label[0]].pos = label[4]
+        for s in self.segment_table:
+            up, down = s["keys"]
+            self.segments[s["name"]].pos = s["start"]
             yield Horizontal(
-                    Static(label[0].title(), classes="box segment_label"),
-                    Static(label[1], classes="box key_label"),
-                    self.segments[label[0]],
-                    Static(label[2], classes="box key_label"),
+                    Static(s["name"].replace("_", " ").title(), classes="box segment_label"),
+                    Static(up.upper(), classes="box key_label"),
+                    self.segments[s["name"]],
+                    Static(down.upper(), classes="box key_label"),
                     classes="controller"
                 )
-        yield Horizontal(
-            Static("Voltage", classes="box segment_label"),
-            self.volt_disp,
-            Static("Current", classes="box segment_label"),
-            self.curr_disp,
-            Static("Position (V)", classes="box segment_label"),
-            self.base_disp,
-            Static("(deg)", classes="box segment_label"),
-            self.base_disp_deg
-        )
+        for board, displays in self.displays.items():
+            displays["state"].pos = "-"
+            yield Horizontal(
+                Static(board.title(), classes="box segment_label"),
+                displays["state"],
+                Static("Voltage", classes="box segment_label"),
+                displays["voltage"],
+                Static("Current", classes="box segment_label"),
+                displays["current"],
+                Static("Position (V)", classes="box segment_label"),
+                displays["base_v"],
+                Static("(deg)", classes="box segment_label"),
+                displays["base_deg"]
+            )
+        yield self.instruments
+
+    def on_key(self, event):
+        if self.move_key(event.key):
+            event.stop()
+
+    def move_key(self, key):
+        """
+        Handle a movement key from the segment table; False for any other
+        key.
+        """
+        move = self.keymap.get(key)
+        if move is None:
+            return False
+        self.hold(*move)
+        return True
 
     def up(self, segment):
-        self.update(segment, 1)
+        self.hold(segment, 1)
 
     def down(self, segment):
-        self.update(segment, -1)
-
+        self.hold(segment, -1)
+
+    def hold(self, segment, direction):
+        """
+        A press or a repeat of a movement key; the joint moves on the
+        control ticks, and takes over from a move in progress.
+        """
+        if self.recorder is not None:
+            self.recorder.input(segment, direction)
+        self.workers.cancel_group(self, "trajectory")
+        self.keys.press(segment, direction, time.monotonic())
+        self.pressed.set()
+
+    async def drive(self):
+        from controlloop import ControlLoop
+        clock = ControlLoop(CONTROL_RATE)
+        while True:
+            if not self.keys:
+                self.pressed.clear()
+                await self.pressed.wait()
+                clock.reset()
+            dt = await clock.await_tick()
+            self.tick(time.monotonic(), dt)
+            clock.done()
+
+    def tick(self, now, dt):
+        steps = self.keys.step(now, dt)
+        for segment, step in steps.items():
+            self.update(segment, step)
+        if steps:
+            # every joint that moved on this tick in one go per board
+            self.boards.flush()
+
+    def clamp(self, segment, value):
+        low, high = self.limits[segment]
+        return max(min(high, value), low)
+
+    @instrument.timed('robot.update')
     def update(self, segment, step):
-        new_val = self.segments[segment].pos + step
-        new_val = max(min(180, new_val), 0)
+        """
+        Stage the joint step degrees further, for the next flush.
+        """
+        new_val = self.clamp(segment, self.segments[segment].pos + step)
         self.segments[segment].pos = new_val
-        self.joints[segment].write(new_val)
-
-    def key_q(self):
-        self.up("base")
-
-    def key_w(self):
-        self.down("base")
-
-    def key_a(self):
-        self.up("link1")
-
-    def key_s(self):
-        self.down("link1")
-
-    def key_z(self):
-        self.up("link2")
-
-    def key_x(self):
-        self.down("link2")
-
-    def key_i(self):
-        self.up("link3")
-
-    def key_o(self):
-        self.down("link3")
-
-    def key_j(self):
-        self.up("headtwist")
-
-    def key_k(self):
-        self.down("headtwist")
-
-    def key_n(self):
-        self.up("claw")
-
-    def key_m(self):
-        self.down("claw")
+        self.joints[segment].stage(new_val)
+        if self.recorder is not None:
+            self.recorder.command(segment, new_val)
+
+    def move_to(self, pose):
+        """
+        Move the joints named in pose, a dict of segment name to angle, to
+        their targets together. A new move replaces the one in progress.
+        """
+        self.run_worker(self.follow(pose), group="trajectory", exclusive=True)
+
+    async def follow(self, pose):
+        from trajectory import plan, stream
+        names = [s["name"] for s in self.segment_table]
+        start = [self.segments[name].pos for name in names]
+        target = [self.clamp(name, pose.get(name, pos)) for name, pos in zip(names, start)]
+
+        def write(row):
+            for name, value in zip(names, row):
+                value = int(round(value))
+                self.segments[name].pos = value
+                self.joints[name].stage(value)
+                if self.recorder is not None:
+                    self.recorder.command(name, value)
+            self.boards.flush()
+
+        await stream(plan(start, target), write)
+
+    def key_t(self):
+        """
+        Show or hide the timings; spans are only timed while shown.
+        """
+        shown = not self.instruments.display
+        instrument.enable(shown)
+        self.instruments.display = shown
+        if shown:
+            self.instruments.refresh_stats()
+
+    def key_h(self):
+        if self.recorder is not None:
+            self.recorder.input("home", 1)
+        self.move_to({s["name"]: s["start"] for s in self.segment_table})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the arms from the keyboard.")
+    backends = parser.add_mutually_exclusive_group()
+    backends.add_argument(
+        '--board', nargs='?', const='', metavar='PORT',
+        help="drive the arms on the ports of the config, PORT replacing that of the first board",
+    )
+    backends.add_argument('--emulate', action='store_true', help="drive a simulated arm over the Firmata emulator")
+    parser.add_argument('--config', default=ARM_CONFIG, metavar='FILE', help="the arms of the cell (default arm.json)")
+    args = parser.parse_args()
+
+    # otherwise the arms are simulated
+    backend, ports = BACKEND, {}
+    if args.emulate:
+        backend = EMULATOR
+    elif args.board is not None:
+        backend = BOARD
+        if args.board:
+            ports[next(iter(load_arm(args.config)[0]))] = args.board
+    RobotController(backend, args.config, ports).run()
@@ -0,0 +1,114 @@
+"""
+One sampler for all analog pins of a board.
+
+On a real board the sampler turns on Firmata analog reporting for its
+pins, sets the board's sampling interval and takes over the handling of
+analog reports, so every report is decoded once and handed to the
+consumers with a timestamp as soon as it is read from the serial port.
+Boards without a serial port (the mocks) are polled every interval,
+either from a single thread or from an event loop.
+"""
+import asyncio
+import time
+from threading import Thread, Event
+
+import instrument
+
+ANALOG_MESSAGE = 0xE0
+SAMPLING_INTERVAL = 0x7A
+INTERVAL = 0.02
+
+
+class AnalogSampler:
+    def __init__(self, board, pins=(), interval=INTERVAL):
+        self.board = board
+        self.interval = interval
+        self.pins = []
+        self.numbers = {}
+        self.consumers = {None: []}
+        self.stopped = Event()
+        self.thread = None
+        if self.reporting:
+            board.add_cmd_handler(ANALOG_MESSAGE, self._handle_analog_message)
+            self.set_interval(interval)
+        for pin in pins:
+            self.add(pin)
+
+    @property
+    def reporting(self):
+        """
+        Whether values arrive as Firmata reports rather than by polling.
+        """
+        return getattr(self.board, 'sp', None) is not None
+
+    def add(self, pin):
+        if pin in self.consumers:
+            return
+        self.pins.append(pin)
+        self.consumers[pin] = []
+        if self.reporting:
+            self.numbers[pin.pin_number] = pin
+            if not pin.reporting:
+                pin.enable_reporting()
+
+    def connect(self, consumer, pin=None):
+        """
+        Call consumer(pin, value, timestamp) for every new value of the
+        pin, or of every pin when no pin is given.
+        """
+        if pin is not None:
+            self.add(pin)
+        self.consumers[pin].append(consumer)
+
+    def emit(self, pin, value, timestamp):
+        for consumer in self.consumers[pin]:
+            consumer(pin, value, timestamp)
+        for consumer in self.consumers[None]:
+            consumer(pin, value, timestamp)
+
+    def _handle_analog_message(self, pin_nr, lsb, msb):
+        # bound method so pyfirmata counts the bytes it needs correctly
+        pin = self.numbers.get(pin_nr)
+        if pin is None:
+            self.board._handle_analog_message(pin_nr, lsb, msb)
+            return
+        pin.value = round(float((msb << 7) + lsb) / 1023, 4)
+        self.emit(pin, pin.value, time.monotonic())
+
+    def set_interval(self, interval):
+        self.interval = interval
+        if self.reporting:
+            ms = int(interval * 1000)
+            self.board.send_sysex(SAMPLING_INTERVAL, [ms & 0x7F, (ms >> 7) & 0x7F])
+
+    @instrument.timed('sampler.poll')
+    def poll(self):
+        now = time.monotonic()
+        for pin in self.pins:
+            self.emit(pin, pin.read(), now)
+
+    def start(self):
+        """
+        Start polling from a thread. Real boards need no thread, their
+        reports are handled by whatever iterates the board.
+        """
+        if self.reporting or self.thread is not None:
+            return
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    async def arun(self):
+        if self.reporting:
+            return
+        while not self.stopped.is_set():
+            self.poll()
+            await asyncio.sleep(self.interval)
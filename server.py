@@ -0,0 +1,403 @@
+"""
+Control of the arms over a local socket.
+
+Clients connect over TCP ("host:port") or a Unix socket (a path) and
+talk in frames: one type byte and the payload length as a little-endian
+uint16, then the payload.
+
+    HELLO      server -> client on connect: the joint names, a newline,
+               and the sensor names, both comma separated
+    TARGETS    client -> server: when the frame was sent (uint64,
+               time.monotonic_ns, 0 for never stale), then for every
+               joint in the batch its index (uint8) and angle (uint16)
+    SUBSCRIBE  client -> server: telemetry interval in ms (uint16), 0 to
+               stop
+    TELEMETRY  server -> client: time (uint64, time.monotonic_ns), the
+               angle of every joint (uint16), the value of every sensor
+               (float32)
+    ERROR      server -> client before it hangs up: what was wrong
+
+Targets are kept, the latest per joint, until the event loop gets round
+to applying them, so targets that arrive in the meantime replace the
+ones waiting instead of queueing up behind them, and a TARGETS frame
+older than STALE when it is read is dropped. Telemetry does not queue
+either: the kernel holds at most SEND_BUFFER bytes for a client, and
+while its socket still holds more than HIGH_WATER bytes on top of that
+the client skips frames.
+
+    python server.py [--listen ADDRESS] [--emulate | --board] [--config FILE]
+"""
+import argparse
+import asyncio
+import math
+import socket
+import struct
+import time
+from functools import partial
+
+import instrument
+from arms import ARM_CONFIG, SIM, EMULATOR, BOARD, SENSOR_PINS, load_arm, open_board
+from boards import BoardManager
+
+ADDRESS = '127.0.0.1:8765'
+# s after it was sent that a TARGETS frame is no longer worth applying
+STALE = 0.1
+# bytes waiting in a client's socket before its telemetry is skipped
+HIGH_WATER = 4096
+SEND_BUFFER = 16384
+
+HEADER = struct.Struct('<BH')
+SENT = struct.Struct('<Q')
+TARGET = struct.Struct('<BH')
+SUBSCRIPTION = struct.Struct('<H')
+
+HELLO = 0x01
+TARGETS = 0x02
+SUBSCRIBE = 0x03
+TELEMETRY = 0x04
+ERROR = 0x7F
+
+# load test clients
+LOAD_DURATION = 5.0
+LOAD_RATE = 100
+LOAD_INTERVAL = 0.02
+
+AGE = instrument.histogram('server.target_age')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def frame(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+async def read_frame(reader):
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+def names(text):
+    return [name for name in text.split(',') if name]
+
+
+async def open_connection(address):
+    if '/' in address:
+        return await asyncio.open_unix_connection(address)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.streaming = None
+        self.skipped = 0
+
+    def send(self, kind, payload):
+        self.writer.write(frame(kind, payload))
+
+    def backlog(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        if self.streaming is not None:
+            self.streaming.cancel()
+        self.writer.close()
+
+
+class ControlServer:
+    def __init__(self, boards, segments, sensors=SENSOR_PINS, stale=STALE, high_water=HIGH_WATER):
+        self.boards = boards
+        self.names = [s["name"] for s in segments]
+        self.pins = [(s["board"], s["pin"]) for s in segments]
+        self.limits = [(s["min"], s["max"]) for s in segments]
+        self.positions = [s["start"] for s in segments]
+        self.sensors = [(board, pin) for board in boards.workers for pin in sensors.values()]
+        sensor_names = [f"{board}.{name}" for board in boards.workers for name in sensors]
+        self.index = {address: k for k, address in enumerate(self.sensors)}
+        self.readings = [0.0] * len(self.sensors)
+        self.hello = f"{','.join(self.names)}\n{','.join(sensor_names)}".encode()
+        self.telemetry_frame = struct.Struct(f'<Q{len(self.names)}H{len(self.sensors)}f')
+        self.stale = int(stale * 1e9)
+        self.high_water = high_water
+        self.pending = {}
+        self.changed = None
+        self.clients = set()
+        self.server = None
+        self.applier = None
+        self.frames = 0
+        self.targets = 0
+        self.superseded = 0
+        self.dropped = 0
+        self.applied = 0
+        self.telemetry_sent = 0
+        self.telemetry_skipped = 0
+        boards.connect(self.on_sample)
+
+    def on_sample(self, address, value, timestamp):
+        # on the thread of the board
+        k = self.index.get(address)
+        if k is not None:
+            self.readings[k] = value
+
+    async def start(self, address=ADDRESS):
+        self.changed = asyncio.Event()
+        for index, angle in enumerate(self.positions):
+            self.boards.write(*self.pins[index], angle)
+        self.boards.flush()
+        self.applier = asyncio.create_task(self.apply())
+        if '/' in address:
+            self.server = await asyncio.start_unix_server(self.handle, address)
+        else:
+            host, port = address.rsplit(':', 1)
+            self.server = await asyncio.start_server(self.handle, host, int(port))
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        for client in list(self.clients):
+            client.close()
+        await self.server.wait_closed()
+        self.applier.cancel()
+
+    async def handle(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = Client(writer)
+        self.clients.add(client)
+        client.send(HELLO, self.hello)
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == TARGETS:
+                    self.take_targets(payload)
+                elif kind == SUBSCRIBE:
+                    self.subscribe(client, payload)
+                else:
+                    raise ProtocolError(f"unknown frame type {kind}")
+        except ProtocolError as e:
+            client.send(ERROR, str(e).encode())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            client.close()
+
+    def take_targets(self, payload):
+        if len(payload) < SENT.size or (len(payload) - SENT.size) % TARGET.size:
+            raise ProtocolError("TARGETS frame of the wrong length")
+        self.frames += 1
+        sent, = SENT.unpack_from(payload)
+        if sent and time.monotonic_ns() - sent > self.stale:
+            self.dropped += 1
+            return
+        for index, angle in TARGET.iter_unpack(payload[SENT.size:]):
+            if index >= len(self.names):
+                raise ProtocolError(f"no joint {index}")
+            low, high = self.limits[index]
+            if index in self.pending:
+                self.superseded += 1
+            self.pending[index] = (max(min(high, angle), low), sent)
+            self.targets += 1
+        self.changed.set()
+
+    async def apply(self):
+        """
+        Hand the targets waiting to the boards, all of them in one go.
+        """
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            pending, self.pending = self.pending, {}
+            now = time.monotonic_ns()
+            for index, (angle, sent) in pending.items():
+                self.boards.write(*self.pins[index], angle)
+                self.positions[index] = angle
+                if sent and instrument.ON:
+                    AGE.record(now - sent)
+            self.boards.flush()
+            self.applied += len(pending)
+
+    def subscribe(self, client, payload):
+        if len(payload) != SUBSCRIPTION.size:
+            raise ProtocolError("SUBSCRIBE frame of the wrong length")
+        interval, = SUBSCRIPTION.unpack(payload)
+        if client.streaming is not None:
+            client.streaming.cancel()
+            client.streaming = None
+        if interval:
+            client.streaming = asyncio.create_task(self.stream(client, interval / 1e3))
+
+    def telemetry(self):
+        return self.telemetry_frame.pack(time.monotonic_ns(), *self.positions, *self.readings)
+
+    async def stream(self, client, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if client.backlog() > self.high_water:
+                client.skipped += 1
+                self.telemetry_skipped += 1
+                continue
+            client.send(TELEMETRY, self.telemetry())
+            self.telemetry_sent += 1
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'frames': self.frames,
+            'targets': self.targets,
+            'superseded': self.superseded,
+            'dropped_stale': self.dropped,
+            'applied': self.applied,
+            'telemetry_sent': self.telemetry_sent,
+            'telemetry_skipped': self.telemetry_skipped,
+        }
+
+
+class ControlClient:
+    """
+    The client side, for scripts and load tests.
+
+        client = await ControlClient.open('127.0.0.1:8765')
+        client.send_targets({'base': 120, 'link1': 30})
+        client.subscribe(0.05)
+        stamp, angles, sensors = await client.receive()
+    """
+    def __init__(self, reader, writer, joints, sensors):
+        self.reader = reader
+        self.writer = writer
+        self.joints = joints
+        self.sensors = sensors
+        self.index = {name: k for k, name in enumerate(joints)}
+        self.telemetry_frame = struct.Struct(f'<Q{len(joints)}H{len(sensors)}f')
+
+    @classmethod
+    async def open(cls, address=ADDRESS):
+        reader, writer = await open_connection(address)
+        kind, payload = await read_frame(reader)
+        if kind != HELLO:
+            raise ProtocolError(f"expected HELLO, got frame type {kind}")
+        joints, sensors = payload.decode().split('\n')
+        return cls(reader, writer, names(joints), names(sensors))
+
+    def send_targets(self, targets, sent=None):
+        """
+        targets maps joint names or indices to angles.
+        """
+        payload = SENT.pack(time.monotonic_ns() if sent is None else sent)
+        payload += b''.join(TARGET.pack(self.joint(joint), int(angle)) for joint, angle in targets.items())
+        self.writer.write(frame(TARGETS, payload))
+
+    def joint(self, joint):
+        index = self.index.get(joint)
+        if index is None:
+            if not isinstance(joint, int) or not 0 <= joint < len(self.joints):
+                raise ValueError(f"no joint {joint!r}, the joints are {', '.join(self.joints)}")
+            index = joint
+        return index
+
+    def subscribe(self, interval):
+        self.writer.write(frame(SUBSCRIBE, SUBSCRIPTION.pack(int(interval * 1000))))
+
+    async def receive(self):
+        """
+        The next telemetry frame: its time, and the joint angles and
+        sensor values by name.
+        """
+        while True:
+            kind, payload = await read_frame(self.reader)
+            if kind == ERROR:
+                raise ProtocolError(payload.decode())
+            if kind == TELEMETRY:
+                values = self.telemetry_frame.unpack(payload)
+                n = len(self.joints)
+                return (
+                    values[0],
+                    dict(zip(self.joints, values[1:n + 1])),
+                    dict(zip(self.sensors, values[n + 1:])),
+                )
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def load(address=ADDRESS, duration=LOAD_DURATION, rate=LOAD_RATE, interval=LOAD_INTERVAL,
+               read=True, phase=0.0):
+    """
+    One load test client: sends every joint a new target rate times a
+    second for duration s, subscribed to telemetry every interval s.
+    With read False it never reads, like a client that hangs.
+    """
+    client = await ControlClient.open(address)
+    if interval:
+        client.subscribe(interval)
+    ages = []
+
+    async def receive():
+        while True:
+            stamp, _, _ = await client.receive()
+            ages.append((time.monotonic_ns() - stamp) / 1e6)
+
+    receiver = None
+    if read:
+        receiver = asyncio.create_task(receive())
+    else:
+        client.writer.transport.pause_reading()
+    sent = 0
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        angle = 90 + 60 * math.sin(2 * math.pi * (time.monotonic() - started) / 2 + phase)
+        client.send_targets({k: angle for k in range(len(client.joints))})
+        await client.writer.drain()
+        sent += 1
+        await asyncio.sleep(1 / rate)
+    if receiver is not None:
+        receiver.cancel()
+    await client.close()
+    ages.sort()
+    return {
+        'frames': sent,
+        'frames_per_s': sent / duration,
+        'telemetry': len(ages),
+        'telemetry_age_p50_ms': ages[len(ages) // 2] if ages else None,
+        'telemetry_age_p99_ms': ages[int(len(ages) * 0.99)] if ages else None,
+    }
+
+
+async def main(address, backend, config):
+    ports, segments = load_arm(config)
+    emulators = {}
+    boards = BoardManager()
+    for name, port in ports.items():
+        boards.add(name, partial(open_board, backend, port, emulators, name), SENSOR_PINS.values())
+    server = ControlServer(boards, segments)
+    boards.start()
+    await server.start(address)
+    print(f"listening on {address}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+        boards.stop()
+        for emulator in emulators.values():
+            emulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control the arms over a local socket.")
+    parser.add_argument('--listen', default=ADDRESS, metavar='ADDRESS', help="host:port, or the path of a Unix socket")
+    backends = parser.add_mutually_exclusive_group()
+    backends.add_argument('--emulate', action='store_true', help="drive a simulated arm over the Firmata emulator")
+    backends.add_argument('--board', action='store_true', help="drive the arms on the ports of the config")
+    parser.add_argument('--config', default=ARM_CONFIG, metavar='FILE', help="the arms of the cell (default arm.json)")
+    args = parser.parse_args()
+    backend = EMULATOR if args.emulate else BOARD if args.board else SIM
+    try:
+        asyncio.run(main(args.listen, backend, args.config))
+    except KeyboardInterrupt:
+        pass
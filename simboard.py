@@ -0,0 +1,225 @@
+"""
+Simulated Firmata board for running the controllers without an arm.
+
+Servo pins follow their command with a first-order response, limited to
+the servo's top speed; continuous servos turn at a speed set by how far
+the command is from the centre. Analog pins are wired to that state:
+a potentiometer reads the position of a servo, a current sensor reads
+the current its servos draw, which grows with how hard they push
+towards their command and with the load on them, and a supply voltage
+sags with the current drawn.
+
+The state of every pin is kept in NumPy arrays and advanced all at once
+whenever a pin is read or written, to the time of a VirtualClock. The
+clock follows wall time at any speed, or only moves when advanced, so
+the simulation can run faster than the hardware.
+
+Pins are got with the same strings as pyfirmata ('d:9:s', 'a:2:i').
+"""
+import math
+import time
+from threading import Lock
+
+import numpy as np
+
+DIGITAL_PINS = 20
+ANALOG_PINS = 6
+# time constant of the servo response (s) and top speed (deg/s)
+TAU = 0.08
+MAX_SPEED = 400.0
+# current drawn by a servo (A): idle, at full effort, and per unit of load
+IDLE_CURRENT = 0.01
+STALL_CURRENT = 0.8
+LOAD_CURRENT = 0.2
+# degrees of error at which a servo pushes with full effort
+FULL_EFFORT = 20.0
+SUPPLY = 0.6
+SAG = 0.005
+NOISE = 0.002
+SERVO = 4
+
+
+class VirtualClock:
+    """
+    Time that runs at speed times wall time, or, with speed None, only
+    when advanced.
+    """
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.offset = 0.0
+        self.started = time.monotonic()
+
+    def now(self):
+        if self.speed is None:
+            return self.offset
+        return self.offset + (time.monotonic() - self.started) * self.speed
+
+    def advance(self, dt):
+        self.offset += dt
+
+
+class SimPin:
+    def __init__(self, board, kind, number, mode):
+        self.board = board
+        self.kind = kind
+        self.pin_number = number
+        self.mode = SERVO if mode == 's' else mode
+        self.reporting = False
+        self.value = None
+
+    def enable_reporting(self):
+        self.reporting = True
+
+    def disable_reporting(self):
+        self.reporting = False
+
+    def read(self):
+        if self.kind == 'a':
+            self.value = self.board.analog(self.pin_number)
+        else:
+            self.value = self.board.position(self.pin_number)
+        return self.value
+
+    def write(self, value):
+        if self.kind == 'a':
+            raise IOError("Cannot write to an analog pin")
+        self.value = value
+        self.board.command(self.pin_number, value)
+
+
+class SimBoard:
+    def __init__(self, clock=None, tau=TAU, max_speed=MAX_SPEED, noise=NOISE, seed=None):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.tau = tau
+        self.max_speed = max_speed
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.lock = Lock()
+        self.t = self.clock.now()
+        self.commanded = np.zeros(DIGITAL_PINS, dtype=bool)
+        self.continuous = np.zeros(DIGITAL_PINS, dtype=bool)
+        self.target = np.full(DIGITAL_PINS, 90.0)
+        self.angle = np.full(DIGITAL_PINS, 90.0)
+        self.velocity = np.zeros(DIGITAL_PINS)
+        self.load = np.zeros(DIGITAL_PINS)
+        # the arm can't move a joint past these, e.g. against an obstacle
+        self.lower = np.zeros(DIGITAL_PINS)
+        self.upper = np.full(DIGITAL_PINS, 180.0)
+        self.current = np.zeros(DIGITAL_PINS)
+        # what each analog pin reads: a fixed value plus a gain times the
+        # position and the current of every servo
+        self.analog_base = np.zeros(ANALOG_PINS)
+        self.analog_position = np.zeros((ANALOG_PINS, DIGITAL_PINS))
+        self.analog_current = np.zeros((ANALOG_PINS, DIGITAL_PINS))
+        self.writes = 0
+
+    def get_pin(self, pin_def):
+        kind, number, mode = pin_def.split(':')
+        return SimPin(self, kind, int(number), mode)
+
+    def wire_position(self, analog, pin, v_min=0.0, v_max=1.0):
+        """
+        A potentiometer on the servo at the pin, reading v_min at 0 and
+        v_max at 180 degrees.
+        """
+        self.analog_base[analog] = v_min
+        self.analog_position[analog] = 0
+        self.analog_position[analog, pin] = (v_max - v_min) / 180
+        self.analog_current[analog] = 0
+
+    def wire_current(self, analog, pins, zero=0.0, gain=1.0):
+        """
+        A current sensor on the servos at the pins, reading zero with no
+        current and gain per ampere.
+        """
+        self.analog_base[analog] = zero
+        self.analog_position[analog] = 0
+        self.analog_current[analog] = 0
+        self.analog_current[analog, list(pins)] = gain
+
+    def wire_supply(self, analog, value=SUPPLY, sag=SAG):
+        """
+        The supply voltage, dropping by sag per ampere drawn by all servos.
+        """
+        self.analog_base[analog] = value
+        self.analog_position[analog] = 0
+        self.analog_current[analog] = -sag
+
+    def set_continuous(self, pin, continuous=True):
+        self.continuous[pin] = continuous
+
+    def set_load(self, pin, load):
+        self.load[pin] = load
+
+    def set_limits(self, pin, lower=0.0, upper=180.0):
+        self.lower[pin] = lower
+        self.upper[pin] = upper
+
+    def advance(self, dt=None):
+        """
+        Bring every servo to the clock's time, or dt seconds further when
+        given (moving the clock along).
+        """
+        with self.lock:
+            if dt is not None:
+                self.clock.advance(dt)
+            now = self.clock.now()
+            self._step(now - self.t)
+            self.t = now
+
+    def _step(self, dt):
+        if dt <= 0:
+            return
+        active = self.commanded
+        # positional: first-order towards the target, at most max_speed
+        error = self.target - self.angle
+        move = error * -math.expm1(-dt / self.tau)
+        move = np.clip(move, -self.max_speed * dt, self.max_speed * dt)
+        # continuous: speed in proportion to the distance from the centre
+        spin = (self.target - 90) / 90 * self.max_speed * dt
+        move = np.where(self.continuous, spin, move)
+        new = np.where(active, self.angle + move, self.angle)
+        new = np.where(self.continuous, new % 360, np.clip(new, self.lower, self.upper))
+        self.velocity = np.where(active & ~self.continuous, new - self.angle, move * active) / dt
+        self.angle = new
+        # effort: how far the servo is from where it is told to be,
+        # blocked or not
+        effort = np.where(self.continuous, np.abs(self.target - 90) / 90, np.abs(self.target - new) / FULL_EFFORT)
+        effort = np.minimum(effort, 1.0)
+        self.current = np.where(
+            active, IDLE_CURRENT + STALL_CURRENT * effort + LOAD_CURRENT * self.load, 0.0
+        )
+
+    def command(self, pin, value):
+        self.advance()
+        with self.lock:
+            self.target[pin] = value
+            self.commanded[pin] = True
+            self.writes += 1
+
+    def position(self, pin):
+        self.advance()
+        return float(self.angle[pin])
+
+    def analogs(self):
+        """
+        What every analog pin reads now, as pyfirmata reports it: 0 to 1
+        in steps of the 10 bit converter, rounded to 4 digits.
+        """
+        self.advance()
+        with self.lock:
+            value = (
+                self.analog_base
+                + self.analog_position @ self.angle
+                + self.analog_current @ self.current
+            )
+        if self.noise:
+            value = value + self.rng.normal(0, self.noise, ANALOG_PINS)
+        value = np.round(np.clip(value, 0, 1) * 1023) / 1023
+        return np.round(value, 4)
+
+    def analog(self, pin):
+        return float(self.analogs()[pin])
+
+    def exit(self):
+        pass
@@ -0,0 +1,169 @@
+"""
+Stall and overcurrent detection on the current sensors, at the rate
+the samples come in.
+
+Every channel, and the sum of all of them, keeps its last WINDOW
+seconds of samples in a ring of preallocated NumPy arrays. With every
+sample the detector updates that row's windowed mean (from a running
+sum), peak and slope (least squares over the window) and checks them:
+
+    OVERCURRENT  the peak is above LIMIT, i.e. on the first sample over
+                 it; for the sum, above TOTAL_LIMIT for the whole supply
+    STALL        the window is full, its mean is above STALL_LEVEL and
+                 it is not falling faster than STALL_SLOPE: the servo
+                 has been pushing hard for a whole window and is not
+                 getting anywhere, unlike the burst at the start of a
+                 move, which dies down as the servo arrives
+
+so an overcurrent is flagged on the sample that shows it and a stall at
+most one window after the current went up. An event goes to every
+handler once, and the channel can only trip again after its values
+were back within bounds.
+
+The sum is updated when the last channel reports, which with the
+sampler's polling or Firmata's reporting is once per round of samples.
+"""
+import time
+
+import numpy as np
+
+import instrument
+
+WINDOW = 0.2
+INTERVAL = 0.02
+# amperes; consumer() converts the sensor readings
+STALL_LEVEL = 0.5
+STALL_SLOPE = 1.0
+LIMIT = 0.95
+TOTAL_LIMIT = 2.0
+
+STALL = 'stall'
+OVERCURRENT = 'overcurrent'
+SUM = 'SUM'
+
+
+class StallEvent:
+    def __init__(self, kind, channel, timestamp, mean, peak, slope):
+        self.kind = kind
+        self.channel = channel
+        # time of the sample that tripped it, and when it was raised
+        self.timestamp = timestamp
+        self.detected = time.monotonic()
+        self.mean = mean
+        self.peak = peak
+        self.slope = slope
+
+    def __repr__(self):
+        return (
+            f"StallEvent({self.kind}, {self.channel}, mean={self.mean:.3f}, "
+            f"peak={self.peak:.3f}, slope={self.slope:.2f})"
+        )
+
+
+class StallDetector:
+    def __init__(self, channels, window=WINDOW, interval=INTERVAL, stall_level=STALL_LEVEL,
+                 stall_slope=STALL_SLOPE, limit=LIMIT, total_limit=TOTAL_LIMIT):
+        self.channels = list(channels) + [SUM]
+        self.rows = {channel: k for k, channel in enumerate(self.channels)}
+        self.last = len(self.channels) - 2
+        self.size = max(int(round(window / interval)), 2)
+        rows = len(self.channels)
+        self.values = np.zeros((rows, self.size))
+        self.times = np.zeros((rows, self.size))
+        self.heads = np.zeros(rows, dtype=int)
+        self.counts = np.zeros(rows, dtype=int)
+        self.sums = np.zeros(rows)
+        self.latest = np.zeros(rows - 1)
+        self.mean = np.zeros(rows)
+        self.peak = np.zeros(rows)
+        self.slope = np.zeros(rows)
+        self.tripped = np.zeros(rows, dtype=bool)
+        # no stall on the sum, only on the servos themselves
+        self.stall_level = np.full(rows, stall_level)
+        self.stall_level[-1] = np.inf
+        self.stall_slope = stall_slope
+        self.limit = np.full(rows, limit)
+        self.limit[-1] = total_limit
+        self._dt = np.zeros(self.size)
+        self._dv = np.zeros(self.size)
+        self.handlers = []
+        self.events = 0
+
+    def connect(self, handler):
+        """
+        Call handler(event) for every event, on the thread of the sample
+        that raised it.
+        """
+        self.handlers.append(handler)
+
+    def consumer(self, channel, zero=0.0, gain=1.0):
+        """
+        A sampler consumer feeding the channel, turning the readings of
+        its sensor into amperes: (value - zero) * gain.
+        """
+        def consume(pin, value, timestamp):
+            if value is not None:
+                self.update(channel, (value - zero) * gain, timestamp)
+        return consume
+
+    @instrument.timed('stall.update')
+    def update(self, channel, value, timestamp):
+        row = self.rows[channel]
+        self.latest[row] = value
+        self.push(row, value, timestamp)
+        self.check(row, timestamp)
+        if row == self.last:
+            self.push(-1, self.latest.sum(), timestamp)
+            self.check(-1, timestamp)
+
+    def push(self, row, value, timestamp):
+        head = self.heads[row]
+        self.sums[row] += value - self.values[row, head]
+        self.values[row, head] = value
+        self.times[row, head] = timestamp
+        head = (head + 1) % self.size
+        self.heads[row] = head
+        if head == 0:
+            # the running sum drifts, start it afresh every lap
+            self.sums[row] = self.values[row].sum()
+        n = self.counts[row] = min(self.counts[row] + 1, self.size)
+        values = self.values[row, :n]
+        times = self.times[row, :n]
+        dt = self._dt[:n]
+        dv = self._dv[:n]
+        mean = self.mean[row] = self.sums[row] / n
+        self.peak[row] = values.max()
+        np.subtract(times, times.mean(), out=dt)
+        np.subtract(values, mean, out=dv)
+        spread = np.dot(dt, dt)
+        self.slope[row] = np.dot(dt, dv) / spread if spread > 0 else 0.0
+
+    def check(self, row, timestamp):
+        kind = None
+        if self.peak[row] > self.limit[row]:
+            kind = OVERCURRENT
+        elif (self.counts[row] == self.size and self.mean[row] > self.stall_level[row]
+              and self.slope[row] > -self.stall_slope):
+            kind = STALL
+        if kind is None:
+            self.tripped[row] = False
+            return
+        if self.tripped[row]:
+            return
+        self.tripped[row] = True
+        self.events += 1
+        event = StallEvent(
+            kind, self.channels[row], timestamp,
+            float(self.mean[row]), float(self.peak[row]), float(self.slope[row]),
+        )
+        for handler in self.handlers:
+            handler(event)
+
+    def stats(self):
+        """
+        The windowed mean, peak and slope of every channel and the sum.
+        """
+        return {
+            channel: (float(self.mean[k]), float(self.peak[k]), float(self.slope[k]))
+            for k, channel in enumerate(self.channels)
+        }
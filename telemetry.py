@@ -0,0 +1,95 @@
+"""
+Fixed-size telemetry store backed by a preallocated NumPy array.
+
+Every write appends one row holding the timestamp and the latest value
+of every channel, so any row is a full snapshot of the arm at that time.
+
+Overwrite policy: the buffer is a ring. Once it holds `capacity` rows
+the oldest row is overwritten by the next write; `overwritten` counts
+how many rows were lost that way. Writers never block on readers and
+the memory used never grows.
+"""
+import time
+from threading import Condition, Lock
+
+import numpy as np
+
+CHANNELS = ('BASE', 'PIVOT', 'ELBOW', 'WRIST', 'A2', 'A3', 'A4', 'A5')
+CAPACITY = 4096
+TIME = 0
+
+
+class TelemetryRing:
+    def __init__(self, channels=CHANNELS, capacity=CAPACITY):
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        # column 0 is the timestamp, then one column per channel
+        self.index = {name: k + 1 for k, name in enumerate(self.channels)}
+        self.data = np.zeros((capacity, len(self.channels) + 1))
+        self._latest = np.zeros(len(self.channels) + 1)
+        self.latest = self._latest.view()
+        self.latest.flags.writeable = False
+        self.count = 0
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        # readers blocked in wait(), writes only notify when there are any
+        self.waiting = 0
+
+    @property
+    def overwritten(self):
+        return max(self.count - self.capacity, 0)
+
+    def write(self, channel, value, timestamp=None):
+        column = self.index[channel]
+        with self.lock:
+            self._latest[TIME] = time.monotonic() if timestamp is None else timestamp
+            self._latest[column] = value
+            self.data[self.count % self.capacity] = self._latest
+            self.count += 1
+            if self.waiting:
+                self.condition.notify_all()
+
+    def value(self, channel):
+        return self._latest[self.index[channel]]
+
+    def values(self):
+        """
+        Read-only view of the latest value of every channel, in channel
+        order. It is not a copy, so it changes as new samples come in.
+        """
+        return self.latest[1:]
+
+    def wait(self, seen, timeout=None):
+        """
+        Block until more than `seen` samples have been written and return
+        the new sample count.
+        """
+        with self.condition:
+            self.waiting += 1
+            try:
+                self.condition.wait_for(lambda: self.count > seen, timeout)
+            finally:
+                self.waiting -= 1
+            return self.count
+
+    def window(self, n=None, channel=None):
+        """
+        The last n rows, oldest first. This is a view into the buffer when
+        the rows are contiguous and a copy when they wrap around its end.
+        """
+        available = min(self.count, self.capacity)
+        n = available if n is None else min(n, available)
+        end = self.count % self.capacity or (self.capacity if self.count else 0)
+        start = end - n
+        if start >= 0:
+            rows = self.data[start:end]
+        else:
+            rows = np.concatenate((self.data[start:], self.data[:end]))
+        if channel is not None:
+            return rows[:, [TIME, self.index[channel]]]
+        return rows
+
+    def since(self, timestamp, channel=None):
+        rows = self.window(channel=channel)
+        first = np.searchsorted(rows[:, TIME], timestamp, side='right')
+        return rows[first:]
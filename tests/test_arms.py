@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+import arms
+from kinematics import Arm
+
+
+def test_segment_limits_come_from_the_joints(tmp_path):
+    _, segments = arms.load_arm()
+    arm = Arm(cache_dir=str(tmp_path))
+    limits = {s['name']: (s['min'], s['max']) for s in segments}
+    for k, name in enumerate(('base', 'link1', 'link2', 'link3')):
+        assert limits[name] == (arm.lower[k], arm.upper[k])
+
+
+def test_limits_given_twice_are_refused(tmp_path):
+    with open(arms.ARM_CONFIG) as f:
+        config = json.load(f)
+    config['segments'][0].update({'min': 10, 'max': 170})
+    path = tmp_path / 'arm.json'
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError, match='base'):
+        arms.load_arm(str(path))
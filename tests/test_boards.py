@@ -0,0 +1,107 @@
+import inspect
+import time
+
+import pytest
+
+from arms import simulated_board
+from boards import BoardManager, CONNECTED, DISCONNECTED, own_handlers
+
+
+def test_connect_pin_of_every_board():
+    boards = BoardManager()
+    left = boards.add('left', None)
+    right = boards.add('right', None, sensors=['a:0:i'])
+    seen = []
+    boards.connect(lambda address, value, timestamp: seen.append(address), pin='a:1:i')
+    assert left.sensors == ['a:1:i']
+    assert right.sensors == ['a:0:i', 'a:1:i']
+    for worker in (left, right):
+        for consumer in worker.consumers:
+            consumer((worker.name, 'a:0:i'), 0.5, 0.0)
+            consumer((worker.name, 'a:1:i'), 0.5, 0.0)
+    assert seen == [('left', 'a:1:i'), ('right', 'a:1:i')]
+
+
+def test_connect_unknown_board():
+    boards = BoardManager()
+    boards.add('left', None)
+    with pytest.raises(ValueError):
+        boards.connect(print, 'right', 'a:0:i')
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_broken_consumer_does_not_stop_the_worker():
+    sim = simulated_board()
+    boards = BoardManager(interval=0.005)
+    worker = boards.add('arm', lambda: sim, sensors=['a:0:i'])
+    seen = []
+
+    def broken(address, value, timestamp):
+        raise ValueError("bug in a display")
+
+    boards.connect(broken)
+    boards.connect(lambda address, value, timestamp: seen.append(value))
+    boards.start()
+    try:
+        wait_for(lambda: len(seen) > 3)
+        assert worker.consumer_errors >= 3
+        assert 'bug in a display' in worker.stats()['consumer_error']
+        assert worker.state == CONNECTED
+    finally:
+        boards.stop(timeout=1.0)
+
+
+def test_unexpected_error_reopens_the_board():
+    sims = [simulated_board(), simulated_board()]
+    states = []
+    boards = BoardManager(on_state=lambda name, state: states.append((state, worker.error)))
+    worker = boards.add('arm', lambda: sims[worker.opened])
+    command = sims[0].command
+
+    def garbled(pin, value):
+        raise RuntimeError("garbled")
+
+    sims[0].command = garbled
+    boards.start()
+    try:
+        wait_for(boards.connected)
+        boards.write('arm', 'd:11:s', 120)
+        boards.flush()
+        wait_for(lambda: worker.opened == 2 and worker.state == CONNECTED)
+        assert worker.lost == 1
+        assert (DISCONNECTED, "RuntimeError('garbled')") in states
+        # the command is sent again to the board opened afresh
+        wait_for(lambda: sims[1].position(11) > 100)
+    finally:
+        sims[0].command = command
+        boards.stop(timeout=1.0)
+
+
+@pytest.mark.skipif(
+    not hasattr(inspect, 'getargspec'), reason="pyfirmata 1.1 needs inspect.getargspec"
+)
+def test_boards_handle_their_own_messages():
+    import pyfirmata
+    from emulator import FirmataEmulator
+    from sampler import ANALOG_MESSAGE
+    pyfirmata.pyfirmata.BOARD_SETUP_WAIT_TIME = 0.1
+    emulators = [FirmataEmulator(simulated_board()) for _ in range(2)]
+    boards = [pyfirmata.Arduino(emulator.start()) for emulator in emulators]
+    try:
+        for board in boards:
+            own_handlers(board)
+            board.analog[3].enable_reporting()
+        # an analog report on pin 3: 512 / 1023
+        boards[0]._command_handlers[ANALOG_MESSAGE](3, 0, 4)
+        assert boards[0].analog[3].value == pytest.approx(0.5005, abs=1e-4)
+        assert boards[1].analog[3].value is None
+    finally:
+        for board, emulator in zip(boards, emulators):
+            board.exit()
+            emulator.stop()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from calibration import Calibrator, Settled, settle_test
+
+
+class Sampler:
+    def connect(self, consumer, pin=None):
+        pass
+
+
+class FakeCalibrator(Calibrator):
+    """
+    A calibrator whose servo reads reading(command) as soon as it is
+    told to go there.
+    """
+    def __init__(self, reading):
+        Calibrator.__init__(self, None, None, Sampler())
+        self.reading = reading
+        self.measured = []
+
+    def measure(self, command):
+        self.measured.append(command)
+        return Settled(command, self.reading(command), 0.0, 0.0, 0.0, True, None)
+
+
+def test_linear_pot_is_not_refined_on_odd_spans():
+    calibrator = FakeCalibrator(lambda c: c / 100)
+    results = calibrator.coarse_to_fine(0, 180, coarse=7, tolerance=0.002)
+    coarse = list(range(0, 181, 7)) + [180]
+    # one midpoint per interval, each found on the line
+    assert len(calibrator.measured) == 2 * len(coarse) - 1
+    assert [r.command for r in results] == sorted(set(calibrator.measured))
+
+
+def test_bent_pot_is_refined_down_to_fine_steps():
+    calibrator = FakeCalibrator(lambda c: (c / 180) ** 3)
+    results = calibrator.coarse_to_fine(0, 180, coarse=10, fine=1, tolerance=0.001)
+    commands = [r.command for r in results]
+    # the steep end is bisected further than the flat one
+    assert np.diff([c for c in commands if c >= 170]).max() < np.diff([c for c in commands if c <= 10]).max()
+
+
+def test_settle_test():
+    t = np.arange(10) * 0.02
+    assert settle_test(np.column_stack([t, np.full(10, 0.3)]))[0]
+    assert not settle_test(np.column_stack([t, 0.3 + t]))[0]
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+import arms
+from calprofile import compile_csv
+
+
+def test_compiled_profile_is_loaded_by_the_app(tmp_path):
+    data = tmp_path / 'data.csv'
+    data.write_text(f"{arms.BASE_V_MIN}, {arms.BASE_V_MAX}")
+    measurements = tmp_path / 'measurements.csv'
+    # a base that lags a few degrees behind its commands
+    command = np.arange(0, 181, 20)
+    x = command - 5 * np.sin(np.radians(command))
+    rows = np.column_stack([command, x, np.zeros((len(command), 3)), np.ones(len(command))])
+    np.savetxt(
+        str(measurements), rows, delimiter=',', fmt='%g',
+        header='command,x,spread,slope,settle_time,settled', comments=''
+    )
+    ports, _ = arms.load_arm()
+    board = next(iter(ports))
+    compiled = compile_csv(str(data), str(measurements), board, 'base', directory=str(tmp_path))
+
+    profile = arms.base_profile(board, directory=str(tmp_path))
+    assert profile.source == compiled.source
+    assert np.allclose(profile.to_command(x), command)
+
+
+def test_uncalibrated_base_is_linear(tmp_path):
+    profile = arms.base_profile('arm', directory=str(tmp_path))
+    assert np.isclose(profile.to_degrees(arms.BASE_V_MAX), 180)
+    assert profile.source == ''
+
+
+def test_base_segment_is_the_one_on_the_base_pot():
+    ports, segments = arms.load_arm()
+    board = next(iter(ports))
+    assert arms.base_segment(segments, board)['pin'] == 'd:11:s'
+    ports, segments = arms.load_arm(os.path.join(arms.HERE, 'cell.json'))
+    assert arms.base_segment(segments, 'right')['name'] == 'right_base'
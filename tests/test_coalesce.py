@@ -0,0 +1,68 @@
+from coalesce import WriteCoalescer, ANALOG_MESSAGE
+
+
+class Pin:
+    def __init__(self, pin_number, mode=4):
+        self.pin_number = pin_number
+        self.mode = mode
+        self.value = None
+        self.writes = []
+
+    def write(self, value):
+        self.writes.append(value)
+
+
+class Port:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+
+class Board:
+    def __init__(self):
+        self.sp = Port()
+
+
+def test_later_writes_replace_staged_ones():
+    writer = WriteCoalescer()
+    pin = Pin(11)
+    writer.write(pin, 10)
+    writer.write(pin, 20)
+    assert writer.flush() == 1
+    assert pin.writes == [20]
+    assert writer.stats() == {'requested': 2, 'sent': 1, 'saved': 1, 'serial_writes': 1}
+
+
+def test_unchanged_values_are_not_sent():
+    writer = WriteCoalescer()
+    pin = Pin(11)
+    writer.write_now(pin, 90)
+    assert writer.write_now(pin, 90) == 0
+    writer.forget(pin)
+    assert writer.write_now(pin, 90) == 1
+    assert pin.writes == [90, 90]
+
+
+def test_servo_pins_go_out_in_one_serial_write():
+    board = Board()
+    writer = WriteCoalescer(board)
+    base, wrist = Pin(11), Pin(3)
+    writer.write(base, 200)
+    writer.write(wrist, 5)
+    assert writer.flush() == 2
+    assert board.sp.writes == [bytes([ANALOG_MESSAGE + 11, 200 % 128, 200 >> 7, ANALOG_MESSAGE + 3, 5, 0])]
+    assert base.value == 200 and base.writes == []
+
+
+def test_other_pins_are_written_one_by_one():
+    board = Board()
+    writer = WriteCoalescer(board)
+    servo, led, high = Pin(11), Pin(13, mode=1), Pin(20)
+    for pin in (servo, led, high):
+        writer.write(pin, 1)
+    writer.flush()
+    assert board.sp.writes == []
+    assert (servo.writes, led.writes, high.writes) == ([1], [1], [1])
+    assert writer.serial_writes == 3
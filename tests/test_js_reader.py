@@ -0,0 +1,82 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from js_reader import JoystickReader, collapse, EVENT, EVENT_AXIS, EVENT_BUTTON, EVENT_INIT
+
+# the kernel's js_event as the PS4 controller code reads it
+JS_EVENT = struct.Struct('3Bh2b')
+
+
+def event(value, type, number, time=(0, 0, 0)):
+    return JS_EVENT.pack(*time, value, type, number)
+
+
+@pytest.fixture
+def pipe():
+    read, write = os.pipe()
+    reader = JoystickReader(fd=read, discrete=[6])
+    yield reader, write
+    reader.close()
+    try:
+        os.close(write)
+    except OSError:
+        pass
+
+
+def events(batch):
+    return [(int(e['type']), int(e['number']), int(e['value'])) for e in batch]
+
+
+def test_layout_matches_js_event():
+    assert EVENT.itemsize == JS_EVENT.size
+
+
+def test_axis_events_collapse(pipe):
+    reader, write = pipe
+    os.write(write, b''.join([
+        event(100, EVENT_AXIS, 0),
+        event(1, EVENT_BUTTON, 0),
+        event(200, EVENT_AXIS, 1),
+        event(300, EVENT_AXIS, 0),
+        event(-32767, EVENT_AXIS, 6),
+        event(0, EVENT_AXIS, 6),
+        event(0, EVENT_BUTTON, 0),
+        event(400, EVENT_AXIS, 1),
+    ]))
+    assert events(reader.read(timeout=1.0)) == [
+        (EVENT_BUTTON, 0, 1),
+        (EVENT_AXIS, 0, 300),
+        # the arrow pad is discrete, every step is kept
+        (EVENT_AXIS, 6, -32767),
+        (EVENT_AXIS, 6, 0),
+        (EVENT_BUTTON, 0, 0),
+        (EVENT_AXIS, 1, 400),
+    ]
+
+
+def test_partial_event_waits_for_the_rest(pipe):
+    reader, write = pipe
+    data = event(1, EVENT_BUTTON, 3) + event(-500, EVENT_AXIS, 2)
+    os.write(write, data[:11])
+    assert events(reader.read(timeout=1.0)) == [(EVENT_BUTTON, 3, 1)]
+    os.write(write, data[11:])
+    assert events(reader.read(timeout=1.0)) == [(EVENT_AXIS, 2, -500)]
+    assert reader.partial == b''
+
+
+def test_init_events_collapse_like_axes():
+    # the type byte is signed, the init flag is its sign bit
+    raw = event(5, (EVENT_AXIS | EVENT_INIT) - 256, 0) + event(7, EVENT_AXIS, 0)
+    batch = np.frombuffer(raw, dtype=EVENT)
+    assert events(collapse(batch)) == [(EVENT_AXIS, 0, 7)]
+
+
+def test_closed_writer_ends_iteration(pipe):
+    reader, write = pipe
+    os.write(write, event(1, EVENT_BUTTON, 1))
+    os.close(write)
+    assert events(list(reader)) == [(EVENT_BUTTON, 1, 1)]
+    assert reader.closed
@@ -0,0 +1,67 @@
+import pytest
+
+from keyhold import KeyHold, REPEAT_GAP, START_SPEED, MAX_SPEED
+
+TICK = 0.02
+
+
+def run(keys, start, end, dt=TICK):
+    moved = {}
+    t = start
+    while t < end:
+        for joint, delta in keys.step(t, dt).items():
+            moved[joint] = moved.get(joint, 0) + delta
+        t += dt
+    return moved
+
+
+def test_tap_moves_one_degree():
+    keys = KeyHold()
+    keys.press('base', 1, 0.0)
+    assert keys.step(0.0, TICK) == {'base': 1}
+    assert run(keys, TICK, 1.0) == {}
+    assert not keys
+
+
+def test_separate_taps_add_up():
+    keys = KeyHold()
+    keys.press('base', -1, 0.0)
+    keys.press('base', -1, REPEAT_GAP + 0.05)
+    assert keys.step(REPEAT_GAP + 0.05, TICK) == {'base': -2}
+
+
+def test_held_key_ramps_up_to_max_speed():
+    keys = KeyHold()
+    moved = []
+    # a terminal repeating the key every 30 ms for 3 s, ticks every 20 ms
+    repeats = iter(k * 0.03 for k in range(100))
+    repeat = next(repeats)
+    for tick in range(200):
+        t = tick * TICK
+        while repeat is not None and repeat <= t:
+            keys.press('link1', 1, repeat)
+            repeat = next(repeats, None)
+        moved.append(keys.step(t, TICK).get('link1', 0))
+    held = sum(moved[:150])
+    assert START_SPEED * 3.0 < held <= MAX_SPEED * 3.0
+    # the last second is at full speed
+    assert sum(moved[100:150]) == pytest.approx(MAX_SPEED, abs=2)
+    # and it stops RELEASE_GAP after the last repeat
+    assert sum(moved[160:]) == 0
+    assert not keys
+
+
+def test_opposite_directions_cancel():
+    keys = KeyHold()
+    keys.press('claw', 1, 0.0)
+    keys.press('claw', -1, 0.0)
+    assert keys.step(0.0, TICK) == {}
+
+
+def test_release_drops_the_joint():
+    keys = KeyHold()
+    keys.press('base', 1, 0.0)
+    keys.press('base', 1, 0.03)
+    keys.press('link1', 1, 0.0)
+    keys.release('base')
+    assert keys.step(0.03, TICK) == {'link1': 1}
@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+import pytest
+
+from kinematics import ARM_CONFIG, Arm, TOLERANCE, Unreachable
+
+
+@pytest.fixture(scope='module')
+def arm(tmp_path_factory):
+    return Arm(cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+def test_inverse_reaches_reachable_targets(arm):
+    rng = np.random.default_rng(0)
+    q = rng.uniform(arm.lower, arm.upper, size=(2000, 4))
+    points = arm.forward(q)
+    solution, residual = arm.inverse(points)
+    assert np.all(residual < TOLERANCE)
+    # the residual is the distance the solution actually leaves
+    assert np.allclose(np.linalg.norm(arm.forward(solution) - points, axis=1), residual)
+    assert np.all((solution >= arm.lower - 1e-6) & (solution <= arm.upper + 1e-6))
+
+
+def test_inverse_reports_unreachable_targets(arm):
+    far = np.array([[0.0, 1000.0, 0.0]])
+    _, residual = arm.inverse(far)
+    assert residual[0] > TOLERANCE
+    with pytest.raises(Unreachable):
+        arm.inverse(far, strict=True)
+
+
+def test_workspace_cache_ignores_ports_and_keys(tmp_path):
+    with open(ARM_CONFIG) as f:
+        config = json.load(f)
+    config['boards'] = {'arm': {'port': '/dev/ttyUSB3'}}
+    config['segments'][0]['keys'] = ['1', '2']
+    path = tmp_path / 'arm.json'
+    path.write_text(json.dumps(config))
+    assert Arm(str(path)).fingerprint == Arm().fingerprint
+    config['links']['link1'] += 1
+    path.write_text(json.dumps(config))
+    assert Arm(str(path)).fingerprint != Arm().fingerprint
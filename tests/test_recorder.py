@@ -0,0 +1,29 @@
+from recorder import Recorder, Replayer, COMMAND, INPUT
+
+
+def test_replay_unclosed_log(tmp_path):
+    path = str(tmp_path / 'session.rlog')
+    recorder = Recorder(path, grow=8)
+    for k in range(21):
+        # a new channel at record 10 rewrites the header
+        recorder.input('button' if k < 10 else 'axis', k)
+    recorder.flush()
+    recorder.command('base', 90)
+    # no close(), as if the process died here
+    replayer = Replayer(path)
+    assert len(replayer.records) == 22
+    assert list(replayer.records['value'][:21]) == list(range(21))
+    assert [name for _, name, _ in replayer.events((INPUT,))][9:11] == ['button', 'axis']
+    assert replayer.select((COMMAND,))['value'][0] == 90
+    recorder.close()
+
+
+def test_replay_closed_log(tmp_path):
+    path = str(tmp_path / 'session.rlog')
+    recorder = Recorder(path, grow=8)
+    for k in range(5):
+        recorder.sample('a:2', k * 0.1)
+    recorder.close()
+    replayer = Replayer(path)
+    assert len(replayer.records) == 5
+    assert replayer.names == ['a:2']
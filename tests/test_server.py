@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from arms import SENSOR_PINS, load_arm, simulated_board
+from boards import BoardManager
+from server import (
+    ControlServer, ControlClient, ProtocolError, HEADER, HELLO, TARGETS, SENT, TARGET, frame, read_frame,
+)
+
+
+def test_frames_round_trip():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(frame(HELLO, b'base\ncurrent') + frame(TARGETS, b''))
+        reader.feed_eof()
+        return [await read_frame(reader), await read_frame(reader)]
+
+    assert asyncio.run(run()) == [(HELLO, b'base\ncurrent'), (TARGETS, b'')]
+    assert len(frame(HELLO, b'abc')) == HEADER.size + 3
+
+
+@pytest.fixture
+def served(tmp_path):
+    """
+    Runs test(server, client, sims) against a server on a Unix socket
+    driving a simulated arm.
+    """
+    def serve(test):
+        ports, segments = load_arm()
+        sims = {name: simulated_board() for name in ports}
+        boards = BoardManager()
+        for name in ports:
+            boards.add(name, lambda name=name: sims[name], SENSOR_PINS.values())
+        server = ControlServer(boards, segments)
+        address = str(tmp_path / 'control.sock')
+
+        async def run():
+            boards.start()
+            await server.start(address)
+            client = await ControlClient.open(address)
+            try:
+                return await test(server, client, sims)
+            finally:
+                await client.close()
+                await server.stop()
+                boards.stop(timeout=1.0)
+
+        return asyncio.run(run())
+    return serve
+
+
+async def until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_hello_names_joints_and_sensors(served):
+    async def test(server, client, sims):
+        assert client.joints == ['base', 'link1', 'link2', 'link3', 'headtwist', 'claw']
+        assert client.sensors == ['arm.current', 'arm.voltage', 'arm.base_res']
+
+    served(test)
+
+
+def test_targets_are_clamped_and_applied(served):
+    async def test(server, client, sims):
+        client.send_targets({'base': 120, 'claw': 500})
+        await until(lambda: server.applied >= 2)
+        assert server.positions[0] == 120
+        assert server.positions[5] == 180
+        await until(lambda: sims['arm'].position(11) > 100)
+
+    served(test)
+
+
+def test_stale_targets_are_dropped(served):
+    async def test(server, client, sims):
+        client.send_targets({'base': 30}, sent=time.monotonic_ns() - int(1e9))
+        client.send_targets({'link1': 45})
+        await until(lambda: server.applied >= 1)
+        assert server.dropped == 1
+        assert server.positions[0] == 90 and server.positions[1] == 45
+
+    served(test)
+
+
+def test_telemetry_stream(served):
+    async def test(server, client, sims):
+        client.subscribe(0.01)
+        stamp, angles, sensors = await asyncio.wait_for(client.receive(), 2.0)
+        assert stamp <= time.monotonic_ns()
+        assert angles['base'] == 90
+        assert set(sensors) == set(client.sensors)
+
+    served(test)
+
+
+def test_unknown_joint_is_refused_by_the_client(served):
+    async def test(server, client, sims):
+        with pytest.raises(ValueError, match='elbow'):
+            client.send_targets({'elbow': 90})
+        with pytest.raises(ValueError, match='6'):
+            client.send_targets({6: 90})
+
+    served(test)
+
+
+def test_bad_frames_get_an_error(served):
+    async def test(server, client, sims):
+        client.writer.write(frame(TARGETS, SENT.pack(0) + TARGET.pack(99, 90)))
+        with pytest.raises(ProtocolError, match='no joint 99'):
+            await asyncio.wait_for(client.receive(), 2.0)
+
+    served(test)
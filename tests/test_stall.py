@@ -0,0 +1,73 @@
+import pytest
+
+from stall import StallDetector, STALL, OVERCURRENT, SUM, INTERVAL, WINDOW
+
+CHANNELS = ('A2', 'A3', 'A4', 'A5')
+# raw reading at no current and amperes per unit, as on the arm
+ZERO, GAIN = 0.5, 2.5
+
+
+def feed(detector, readings, start=0.0):
+    """
+    Rounds of raw readings, one value per channel, INTERVAL apart.
+    """
+    consumers = [detector.consumer(channel, ZERO, GAIN) for channel in CHANNELS]
+    t = start
+    for values in readings:
+        for consume, value in zip(consumers, values):
+            consume(None, value, t)
+        t += INTERVAL
+    return t
+
+
+def raw(amperes):
+    return ZERO + amperes / GAIN
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def detector(events):
+    detector = StallDetector(CHANNELS)
+    detector.connect(events.append)
+    return detector
+
+
+def test_idle_sensors_do_not_trip(detector, events):
+    feed(detector, [[raw(0.0)] * 4] * 100)
+    assert events == []
+    assert detector.stats()['A3'][0] == pytest.approx(0.0)
+
+
+def test_held_current_is_a_stall(detector, events):
+    rounds = int(WINDOW / INTERVAL)
+    feed(detector, [[raw(0), raw(0.7), raw(0), raw(0)]] * (rounds + 2))
+    assert [(e.kind, e.channel) for e in events] == [(STALL, 'A3')]
+
+
+def test_falling_current_is_not_a_stall(detector, events):
+    # the burst at the start of a move, dying down as the servo arrives
+    feed(detector, [[raw(0), raw(0.9 - 0.06 * k), raw(0), raw(0)] for k in range(15)])
+    assert [e for e in events if e.kind == STALL] == []
+
+
+def test_overcurrent_on_the_first_sample_over_the_limit(detector, events):
+    t = feed(detector, [[raw(0)] * 4] * 5)
+    feed(detector, [[raw(0), raw(0), raw(1.0), raw(0)]], start=t)
+    assert [(e.kind, e.channel, e.timestamp) for e in events] == [(OVERCURRENT, 'A4', t)]
+
+
+def test_sum_over_the_supply_limit(detector, events):
+    feed(detector, [[raw(0.6)] * 4])
+    assert (OVERCURRENT, SUM) in [(e.kind, e.channel) for e in events]
+
+
+def test_trips_again_only_after_recovering(detector, events):
+    t = feed(detector, [[raw(0), raw(1.0), raw(0), raw(0)]] * 3)
+    assert len(events) == 1
+    t = feed(detector, [[raw(0)] * 4] * 20, start=t)
+    feed(detector, [[raw(0), raw(1.0), raw(0), raw(0)]], start=t)
+    assert len(events) == 2
@@ -0,0 +1,20 @@
+from threading import Thread
+import time
+
+from telemetry import TelemetryRing
+
+
+def test_wait_wakes_on_write():
+    ring = TelemetryRing(channels=('POSITION',))
+    ring.write('POSITION', 0.1)
+    writer = Thread(target=lambda: (time.sleep(0.05), ring.write('POSITION', 0.2)))
+    writer.start()
+    assert ring.wait(1, timeout=2.0) == 2
+    writer.join()
+    assert ring.waiting == 0
+    assert ring.value('POSITION') == 0.2
+
+
+def test_wait_times_out():
+    ring = TelemetryRing(channels=('POSITION',))
+    assert ring.wait(0, timeout=0.01) == 0
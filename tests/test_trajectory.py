@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from trajectory import plan, profile, stream
+
+RATE = 50
+
+
+def test_joints_start_and_arrive_together():
+    samples = plan([0, 90, 180], [90, 90, 0], rate=RATE)
+    assert np.allclose(samples[-1], [90, 90, 0])
+    assert np.all(samples[:, 1] == 90)
+    # every joint is the same fraction of the way at every tick
+    fraction = (samples - [0, 90, 180]) / [90, 1, -180]
+    assert np.allclose(fraction[:, 0], fraction[:, 2])
+
+
+def test_joint_limits_hold():
+    vmax = np.array([30.0, 90.0])
+    amax = np.array([60.0, 180.0])
+    samples = plan([0, 0], [60, -120], vmax=vmax, amax=amax, rate=RATE)
+    speed = np.abs(np.diff(samples, axis=0)) * RATE
+    assert np.all(speed <= vmax * 1.01)
+    accel = np.abs(np.diff(speed, axis=0)) * RATE
+    # the last tick is shorter, leave it out
+    assert np.all(accel[:-1] <= amax * 1.05)
+
+
+def test_short_move_never_reaches_full_speed():
+    s, duration = profile(np.array([0.0, 0.5, 1.0]), v=10.0, a=4.0)
+    assert duration == pytest.approx(1.0)
+    assert np.allclose(s, [0, 0.5, 1])
+
+
+def test_plans_are_cached_and_read_only():
+    first = plan([0, 0], [10, 20])
+    assert plan((0.0, 0.0), (10.0, 20.0)) is first
+    with pytest.raises(ValueError):
+        first[0, 0] = 1
+
+
+def test_no_move_is_one_row():
+    assert plan([5, 6], [5, 6]).tolist() == [[5, 6]]
+
+
+def test_stream_writes_every_row():
+    samples = plan([0], [10], rate=200)
+    rows = []
+    asyncio.run(stream(samples, rows.append, rate=200))
+    assert np.array_equal(np.array(rows), samples)
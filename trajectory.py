@@ -0,0 +1,95 @@
+"""
+Synchronized multi-joint trajectories.
+
+All joints of a move follow the same normalized trapezoidal profile
+s(t), going from 0 to 1, scaled by how far each joint has to go. The
+profile's speed and acceleration are the tightest that keep every joint
+within its own limits, so all joints start and arrive together and none
+exceeds its limits. The profile is sampled at the control rate for the
+whole move at once with NumPy.
+
+Planned trajectories are cached by start, target, limits and rate, so
+repeating a move costs a dict lookup.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from controlloop import ControlLoop
+
+VMAX = 90.0
+AMAX = 180.0
+RATE = 50
+CACHE_SIZE = 256
+
+
+def profile(t, v, a):
+    """
+    Trapezoidal profile from 0 to 1 with peak speed v and acceleration a,
+    evaluated at the times t. Returns s(t) and the duration of the move.
+    """
+    if v * v / a >= 1:
+        # never reaches full speed
+        t_acc = np.sqrt(1 / a)
+        v = a * t_acc
+        duration = 2 * t_acc
+    else:
+        t_acc = v / a
+        duration = 1 / v + t_acc
+    t = np.clip(t, 0, duration)
+    t_dec = duration - t_acc
+    s = np.where(
+        t < t_acc, 0.5 * a * t * t,
+        np.where(
+            t <= t_dec, 0.5 * a * t_acc * t_acc + v * (t - t_acc),
+            1 - 0.5 * a * (duration - t) ** 2
+        )
+    )
+    return s, duration
+
+
+def plan(start, target, vmax=VMAX, amax=AMAX, rate=RATE):
+    """
+    Joint positions, one row per control tick, to go from start to
+    target. vmax and amax are per joint or shared by all joints. The
+    returned array is cached and read-only.
+    """
+    start = tuple(float(x) for x in start)
+    target = tuple(float(x) for x in target)
+    n = len(start)
+    vmax = tuple(np.broadcast_to(np.asarray(vmax, dtype=float), n).tolist())
+    amax = tuple(np.broadcast_to(np.asarray(amax, dtype=float), n).tolist())
+    return _plan(start, target, vmax, amax, rate)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _plan(start, target, vmax, amax, rate):
+    start = np.array(start)
+    distance = np.array(target) - start
+    moving = distance != 0
+    if not moving.any():
+        samples = start[np.newaxis, :].copy()
+        samples.flags.writeable = False
+        return samples
+    span = np.abs(distance[moving])
+    v = np.min(np.array(vmax)[moving] / span)
+    a = np.min(np.array(amax)[moving] / span)
+    _, duration = profile(0.0, v, a)
+    t = np.append(np.arange(1, int(np.ceil(duration * rate))) / rate, duration)
+    s, _ = profile(t, v, a)
+    samples = start + np.outer(s, distance)
+    samples.flags.writeable = False
+    return samples
+
+
+async def stream(samples, write, rate=RATE):
+    """
+    Hand one row of samples to write() per control tick, awaiting the
+    tick deadlines on the running event loop.
+    """
+    clock = ControlLoop(rate)
+    for row in samples:
+        await clock.await_tick()
+        write(row)
+        clock.done()
+    return clock
@@ -0,0 +1,67 @@
+"""
+Batched, rate-limited updates from telemetry to Textual widgets.
+
+Producers publish the value a widget should show, from the event loop
+or from any other thread; the latest value per key waits in a dict
+behind a lock. On every tick of the UI timer the bridge takes all the
+values waiting as one snapshot, drops the ones the widget already
+shows, and assigns the rest inside one batch_update(), so a snapshot
+costs at most one repaint however many widgets it touches and however
+fast the sensors report. Widgets are only ever written from the app's
+event loop, by the timer.
+"""
+from threading import Lock
+
+UI_INTERVAL = 0.1
+
+
+class UIBridge:
+    def __init__(self, app, interval=UI_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self.lock = Lock()
+        self.pending = {}
+        self.shown = {}
+        self.targets = {}
+        self.timer = None
+        self.snapshots = 0
+        self.updates = 0
+        self.skipped = 0
+
+    def bind(self, key, widget, attribute='pos'):
+        self.targets[key] = (widget, attribute)
+
+    def publish(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+
+    def start(self):
+        self.timer = self.app.set_interval(self.interval, self.apply)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+    def apply(self):
+        with self.lock:
+            if not self.pending:
+                return
+            snapshot, self.pending = self.pending, {}
+        self.snapshots += 1
+        changed = [(key, value) for key, value in snapshot.items() if self.shown.get(key) != value]
+        self.skipped += len(snapshot) - len(changed)
+        if not changed:
+            return
+        with self.app.batch_update():
+            for key, value in changed:
+                widget, attribute = self.targets[key]
+                setattr(widget, attribute, value)
+                self.shown[key] = value
+        self.updates += len(changed)
+
+    def stats(self):
+        return {
+            'snapshots': self.snapshots,
+            'updates': self.updates,
+            'skipped': self.skipped,
+        }